@@ -0,0 +1,78 @@
+"""
+CPU admission control for OCR jobs.
+
+ocrmypdf processes the pages of a document with as many parallel workers as
+its jobs option says, which defaults to every CPU, so a handful of
+concurrent documents start several times more tesseract processes than
+there are cores. CpuBudget hands out CPU tokens instead: a job starts once
+it gets at least one, runs with as many page workers as tokens it got and
+gives them back when it finishes. Jobs waiting for tokens are served in
+order of arrival, and no job gets more than its fair share of the tokens
+(split among the jobs running and waiting, itself included), so a long
+document does not keep the CPUs from the jobs queued behind it.
+"""
+import collections
+import threading
+import time
+
+from ocrmypdf.helpers import available_cpu_count
+
+
+def default_tokens(processes=1):
+    """
+    CPUs available to this process (as ocrmypdf counts them), shared among
+    the server processes
+    """
+    return max(1, available_cpu_count() // processes)
+
+
+class CpuBudget:
+    """
+    Fixed number of CPU tokens shared by the OCR jobs of this process
+    """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.free = tokens
+        self._waiting = collections.deque()
+        self._allotted = {}
+        self._changed = threading.Condition()
+        self._granted = 0
+        self._wait_seconds = 0.0
+
+    def acquire(self, job_id, want):
+        """
+        Wait for the job's turn and return the tokens allotted to it: as many
+        as it wants (one per page is the most it can use), as long as they
+        are free and within its fair share, and at least one
+        """
+        want = max(1, min(want, self.tokens))
+        start = time.monotonic()
+        with self._changed:
+            self._waiting.append(job_id)
+            self._changed.wait_for(lambda: self._waiting[0] == job_id and self.free > 0)
+            self._waiting.popleft()
+            share = self.tokens // (len(self._allotted) + len(self._waiting) + 1)
+            allotted = max(1, min(want, self.free, share))
+            self.free -= allotted
+            self._allotted[job_id] = allotted
+            self._granted += 1
+            self._wait_seconds += time.monotonic() - start
+            # The next job in line may fit in what is left
+            self._changed.notify_all()
+        return allotted
+
+    def release(self, job_id):
+        with self._changed:
+            self.free += self._allotted.pop(job_id)
+            self._changed.notify_all()
+
+    def stats(self):
+        with self._changed:
+            return {
+                "tokens": self.tokens,
+                "free": self.free,
+                "waiting": len(self._waiting),
+                "allotted": dict(self._allotted),
+                "mean_wait_seconds": self._wait_seconds / max(1, self._granted),
+            }
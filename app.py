@@ -1,13 +1,33 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, url_for
 from flask_cors import CORS
-import subprocess
-import os
+import json
 import logging
+import os
 import traceback
 import sys
-import tempfile
+from urllib.parse import unquote
+
+from werkzeug.exceptions import RequestEntityTooLarge
+
+import config
+from admission import CpuBudget, default_tokens
+from jobs import FAILED, JobQueue, QueueFullError
+from page_stream import read_manifest
+from result_cache import ResultCache
+from uploads import (
+    ChecksumMismatchError,
+    IncompleteUploadError,
+    InvalidPdfError,
+    SpoolingRequest,
+    UploadStore,
+    adopt_spooled_file,
+    spool_stream,
+    triage,
+)
 
 app = Flask(__name__)
+app.request_class = SpoolingRequest
+app.config["MAX_CONTENT_LENGTH"] = config.MAX_UPLOAD_BYTES
 CORS(app)
 
 # Configure logging
@@ -21,108 +41,442 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+job_queue = JobQueue(
+    workers=config.OCR_WORKERS,
+    max_queued=config.OCR_QUEUE_SIZE,
+    data_dir=config.DATA_DIR,
+    ttl=config.JOB_TTL,
+    cache=ResultCache(config.CACHE_DIR, config.CACHE_MAX_BYTES),
+    budget=CpuBudget(config.CPU_BUDGET or default_tokens(config.SERVER_PROCESSES)),
+)
+upload_store = UploadStore(
+    directory=config.UPLOAD_DIR,
+    chunk_size=config.RESUMABLE_CHUNK_SIZE,
+    max_bytes=config.MAX_UPLOAD_BYTES,
+    ttl=config.UPLOAD_TTL,
+)
 
-@app.route("/process-pdf", methods=["POST"])
-def process_pdf():
+
+def _unexpected_error(e):
+    logger.error(f"Unexpected error: {e}")
+    logger.error(traceback.format_exc())
+    return (
+        jsonify(
+            {
+                "error": "Error inesperado al procesar el documento",
+                "details": str(e),
+            }
+        ),
+        500,
+    )
+
+
+def _receive_upload(job):
+    """
+    Write the uploaded PDF to the job's input file and return its name.
+
+    A body sent as application/pdf is streamed to disk as it arrives (the
+    file name goes in the X-Filename header); multipart uploads are spooled
+    straight into the job directory by SpoolingRequest.
+
+    Returns (filename, None) on success or (None, error_response) otherwise.
+    """
+    if request.mimetype == "application/pdf":
+        filename = unquote(request.headers.get("X-Filename", "")) or "document.pdf"
+        spool_stream(
+            request.stream,
+            job.input_path,
+            config.MAX_UPLOAD_BYTES,
+            config.UPLOAD_CHUNK_SIZE,
+        )
+        return filename, None
+
+    request.spool_dir = job.work_dir
+
+    # Verificar si se ha enviado un archivo PDF
+    if "file" not in request.files:
+        logger.error("No file part in the request")
+        return None, (jsonify({"error": "No file part"}), 400)
+
+    file = request.files["file"]
+
+    # Verificar si el archivo tiene un nombre
+    if file.filename == "":
+        logger.error("No selected file")
+        return None, (jsonify({"error": "No selected file"}), 400)
+
+    # Verificar si es un PDF
+    if not file.filename.lower().endswith(".pdf"):
+        logger.error(f"Invalid file type: {file.filename}")
+        return None, (jsonify({"error": "Solo se permiten archivos PDF"}), 400)
+
+    adopt_spooled_file(file, job.input_path)
+    return file.filename, None
+
+
+def _enqueue_upload(receive=_receive_upload):
+    """
+    Store the uploaded PDF in a new job, check it and queue it.
+
+    receive(job) puts the PDF at job.input_path, as _receive_upload does.
+    Returns (job, None) on success or (None, error_response) otherwise.
+    """
+    job = job_queue.create_job(None)
+    # ?stream=1: publicar las páginas terminadas mientras avanza el OCR
+    job.stream = request.args.get("stream") == "1"
+    try:
+        filename, error = receive(job)
+        if error:
+            job_queue.discard(job)
+            return None, error
+        job.filename = filename
+        job.pages = triage(job.input_path)
+    except InvalidPdfError as e:
+        logger.error(f"Invalid PDF upload: {e}")
+        job_queue.discard(job)
+        return None, (jsonify({"error": "El archivo no es un PDF válido"}), 400)
+    except RequestEntityTooLarge:
+        logger.error("Upload exceeds the maximum size")
+        job_queue.discard(job)
+        return None, (
+            jsonify({"error": "El archivo supera el tamaño máximo permitido"}),
+            413,
+        )
+    except Exception:
+        job_queue.discard(job)
+        raise
+
+    try:
+        job_queue.submit(job)
+    except QueueFullError:
+        logger.warning(f"Rejected {job.filename}: OCR queue is full")
+        return None, (
+            jsonify({"error": "El servidor está ocupado, inténtalo más tarde"}),
+            503,
+            {"Retry-After": "30"},
+        )
+    return job, None
+
+
+def _job_created_response(job):
+    status_url = url_for("job_status", job_id=job.id)
+    data = {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": status_url,
+        "events_url": url_for("job_events", job_id=job.id),
+        "result_url": url_for("job_result", job_id=job.id),
+    }
+    if job.stream:
+        data["pages_url"] = url_for("job_pages", job_id=job.id)
+    return jsonify(data), 202, {"Location": status_url}
+
+
+def _job_error_response(job):
+    return jsonify({"error": job.error, "details": job.details}), 500
+
+
+def _send_result(job):
+    """
+    Stream the job's output file instead of reading it into memory.
+
+    The file is handed to the WSGI server's file wrapper (sendfile where the
+    server supports it), and conditional requests get ETag, Last-Modified
+    and Range handling from send_file.
+    """
+    return send_file(
+        job.output_path,
+        mimetype="application/pdf",
+        download_name=f"OCR-{job.filename}",
+        conditional=True,
+        etag=True,
+        max_age=0,
+    )
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
     try:
-        # Verificar si se ha enviado un archivo PDF
-        if "file" not in request.files:
-            logger.error("No file part in the request")
-            return jsonify({"error": "No file part"}), 400
-
-        file = request.files["file"]
-
-        # Verificar si el archivo tiene un nombre
-        if file.filename == "":
-            logger.error("No selected file")
-            return jsonify({"error": "No selected file"}), 400
-
-        # Verificar si es un PDF
-        if not file.filename.lower().endswith(".pdf"):
-            logger.error(f"Invalid file type: {file.filename}")
-            return jsonify({"error": "Solo se permiten archivos PDF"}), 400
-
-        # Usar tempfile para manejar archivos temporales de manera segura
-        with tempfile.NamedTemporaryFile(
-            delete=False, suffix="_input.pdf"
-        ) as temp_input, tempfile.NamedTemporaryFile(
-            delete=False, suffix="_ocr.pdf"
-        ) as temp_output:
-
-            # Guardar el archivo de entrada
-            file.save(temp_input.name)
-            temp_input.close()
-            temp_output.close()
-
-            try:
-                # Ejecutar ocrmypdf con forzado de OCR
-                result = subprocess.run(
-                    [
-                        "ocrmypdf",
-                        "--force-ocr",  # Forzar OCR incluso si ya tiene texto
-                        temp_input.name,
-                        temp_output.name,
-                    ],
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                )
-                logger.info(f"OCR processing successful: {result.stdout}")
-
-                # Leer el archivo de salida
-                with open(temp_output.name, "rb") as output_file:
-                    response = output_file.read()
-
-                return response, 200, {"Content-Type": "application/pdf"}
-
-            except subprocess.CalledProcessError as e:
-                logger.error(f"OCR processing failed: {e}")
-                logger.error(f"STDOUT: {e.stdout}")
-                logger.error(f"STDERR: {e.stderr}")
-
-                return (
-                    jsonify(
-                        {
-                            "error": "Error procesando el PDF",
-                            "details": str(e),
-                            "stdout": e.stdout,
-                            "stderr": e.stderr,
-                        }
-                    ),
-                    500,
-                )
-
-            finally:
-                # Limpiar archivos temporales
-                for temp_path in [temp_input.name, temp_output.name]:
-                    try:
-                        os.unlink(temp_path)
-                    except Exception as cleanup_error:
-                        logger.error(
-                            f"Error eliminando archivo temporal {temp_path}: {cleanup_error}"
-                        )
+        job, error = _enqueue_upload()
+        if error:
+            return error
+        return _job_created_response(job)
 
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        logger.error(traceback.format_exc())
+        return _unexpected_error(e)
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Server-sent events with the job's state every time it changes, ending
+    with a "done" or "failed" event
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+
+    def stream():
+        version = None
+        while True:
+            new_version = job.wait_for_update(version, config.EVENTS_KEEPALIVE)
+            if new_version == version:
+                # Comentario SSE para que los proxies no cierren la conexión
+                yield ": keepalive\n\n"
+                continue
+            version = new_version
+            data = json.dumps(job.to_dict())
+            if job.finished:
+                yield f"event: {job.status}\ndata: {data}\n\n"
+                return
+            yield f"event: progress\ndata: {data}\n\n"
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if job.status == FAILED:
+        return _job_error_response(job)
+    if not job.finished:
+        return jsonify(job.to_dict()), 409
+
+    return _send_result(job)
+
+
+@app.route("/jobs/<job_id>/pages", methods=["GET"])
+def job_pages(job_id):
+    """
+    Page ranges of a streamed job that can already be downloaded, in order
+    """
+    job = job_queue.get(job_id)
+    if job is None or not job.stream:
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if job.status == FAILED:
+        return _job_error_response(job)
+
+    # Sin manifiesto todavía, o el resultado vino de la caché sin pasar por
+    # el OCR: en ese caso el documento completo ya está en result_url
+    manifest = read_manifest(job.pages_dir) or {
+        "pages": job.pages,
+        "ranges": [],
+        "complete": job.finished,
+    }
+    for part in manifest["ranges"]:
+        part["url"] = url_for("job_page_range", job_id=job.id, name=part["file"])
+    manifest["status"] = job.status
+    manifest["result_url"] = url_for("job_result", job_id=job.id)
+    return jsonify(manifest)
+
+
+@app.route("/jobs/<job_id>/pages/<name>", methods=["GET"])
+def job_page_range(job_id, name):
+    job = job_queue.get(job_id)
+    manifest = read_manifest(job.pages_dir) if job and job.stream else None
+    if manifest is None or name not in {p["file"] for p in manifest["ranges"]}:
+        return jsonify({"error": "Páginas no encontradas"}), 404
+
+    first, last = name[: -len(".pdf")].split("-")
+    return send_file(
+        os.path.join(job.pages_dir, name),
+        mimetype="application/pdf",
+        download_name=f"OCR-{int(first)}-{int(last)}-{job.filename}",
+        conditional=True,
+        etag=True,
+        max_age=0,
+    )
+
+
+def _upload_not_found():
+    return jsonify({"error": "Subida no encontrada"}), 404
+
+
+@app.route("/uploads", methods=["POST"])
+def create_upload():
+    """
+    Start a resumable upload: the client then PUTs each chunk and finalizes
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or "document.pdf"
+    size = data.get("size")
+    if not isinstance(size, int):
+        return jsonify({"error": "Falta el tamaño del archivo"}), 400
+    if not filename.lower().endswith(".pdf"):
+        logger.error(f"Invalid file type: {filename}")
+        return jsonify({"error": "Solo se permiten archivos PDF"}), 400
+    try:
+        upload = upload_store.create(filename, size)
+    except InvalidPdfError:
+        return jsonify({"error": "El archivo está vacío"}), 400
+    except RequestEntityTooLarge:
+        return jsonify({"error": "El archivo supera el tamaño máximo permitido"}), 413
+
+    upload_url = url_for("upload_status", upload_id=upload.id)
+    return (
+        jsonify({**upload.to_dict(), "upload_url": upload_url}),
+        201,
+        {"Location": upload_url},
+    )
+
+
+@app.route("/uploads/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    return jsonify(upload.to_dict())
+
+
+@app.route("/uploads/<upload_id>", methods=["DELETE"])
+def cancel_upload(upload_id):
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    upload_store.discard(upload)
+    return "", 204
+
+
+@app.route("/uploads/<upload_id>/chunks/<int:index>", methods=["PUT"])
+def upload_chunk(upload_id, index):
+    """
+    Store one chunk; the X-Chunk-SHA256 header carries its hex SHA-256
+    """
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return _upload_not_found()
+    checksum = request.headers.get("X-Chunk-SHA256")
+    if not checksum:
+        return jsonify({"error": "Falta la cabecera X-Chunk-SHA256"}), 400
+    try:
+        upload_store.write_chunk(
+            upload, index, request.stream, checksum, config.UPLOAD_CHUNK_SIZE
+        )
+    except FileNotFoundError:
+        return _upload_not_found()  # Cancelada o finalizada mientras tanto
+    except IndexError:
+        return jsonify({"error": "Número de bloque fuera de rango"}), 416
+    except (ValueError, ChecksumMismatchError) as e:
+        # No se ha guardado nada; el cliente solo tiene que reenviarlo
+        logger.warning(f"Upload {upload_id}: {e}")
+        return jsonify({"error": "El bloque llegó dañado", "details": str(e)}), 422
+    return jsonify(upload.to_dict())
+
+
+@app.route("/uploads/<upload_id>/finalize", methods=["POST"])
+def finalize_upload(upload_id):
+    """
+    Turn a fully received upload into an OCR job
+    """
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        return _upload_not_found()
+
+    def receive(job):
+        upload_store.complete(upload, job.input_path)
+        return upload.filename, None
+
+    try:
+        job, error = _enqueue_upload(receive)
+        if error:
+            return error
+        return _job_created_response(job)
+
+    except IncompleteUploadError as e:
         return (
-            jsonify(
-                {
-                    "error": "Error inesperado al procesar el documento",
-                    "details": str(e),
-                }
-            ),
-            500,
+            jsonify({"error": "Faltan bloques por subir", "missing": e.missing}),
+            409,
         )
+    except FileNotFoundError:
+        return _upload_not_found()  # Otra petición la finalizó antes
+    except Exception as e:
+        return _unexpected_error(e)
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    # Cada proceso del servidor tiene su propia cola: las cifras son de este
+    return jsonify(
+        {
+            "pid": os.getpid(),
+            "jobs": job_queue.stats(),
+            "cache": job_queue.cache.stats(),
+        }
+    )
+
+
+@app.route("/process-pdf", methods=["POST"])
+def process_pdf():
+    """
+    Synchronous variant kept for existing clients: goes through the same job
+    queue and waits for the result.
+
+    After PDFOCR_REQUEST_TIMEOUT seconds it gives up waiting and answers 504
+    with the job's status URL; the job keeps running and its result can be
+    fetched from there.
+    """
+    try:
+        job, error = _enqueue_upload()
+        if error:
+            return error
+
+        if not job.done.wait(config.REQUEST_TIMEOUT or None):
+            logger.warning(f"Job {job.id} still running after the request timeout")
+            status_url = url_for("job_status", job_id=job.id)
+            return (
+                jsonify(
+                    {
+                        "error": "El documento sigue procesándose",
+                        "job_id": job.id,
+                        "status_url": status_url,
+                        "result_url": url_for("job_result", job_id=job.id),
+                    }
+                ),
+                504,
+                {"Location": status_url},
+            )
+
+        if job.status == FAILED:
+            job_queue.discard(job)
+            return _job_error_response(job)
+
+        try:
+            response = _send_result(job)
+        except Exception:
+            job_queue.discard(job)
+            raise
+        # Limpiar archivos temporales cuando termine el envío, no antes
+        response.call_on_close(lambda: job_queue.discard(job))
+        return response
+
+    except Exception as e:
+        return _unexpected_error(e)
 
 
 if __name__ == "__main__":
     # Verificar dependencias antes de iniciar
     try:
-        subprocess.run(["which", "ocrmypdf"], check=True)
-        logger.info("ocrmypdf is installed and accessible")
-    except subprocess.CalledProcessError:
-        logger.error("ocrmypdf is not installed or not in PATH")
+        import ocrmypdf
+
+        logger.info(f"ocrmypdf {ocrmypdf.__version__} is installed and importable")
+    except ImportError:
+        logger.error("ocrmypdf is not installed in this Python environment")
         sys.exit(1)
 
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    # Servidor de desarrollo; en producción usar gunicorn (ver gunicorn.conf.py)
+    host, port = config.BIND.rsplit(":", 1)
+    app.run(debug=True, host=host, port=int(port))
@@ -0,0 +1,2 @@
+# Benchmark scripts; run them from the repository root, e.g.
+#   python -m benchmarks.bench_startup
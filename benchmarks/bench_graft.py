@@ -0,0 +1,135 @@
+"""
+Graft phase time by document size: ocrmypdf's OcrGrafter vs ChunkedGrafter.
+
+Builds synthetic documents of each size, then grafts the same rasterized
+page and text layer onto every page, as the pipeline does for each OCR'd
+page with force_ocr, and saves the result. ocrmypdf's grafter rewrites the
+whole document every 100 pages, so its time per page grows with the size;
+the chunked grafter's should stay flat.
+
+    python -m benchmarks.bench_graft --pages 1000 5000 10000
+"""
+import argparse
+import io
+import os
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import img2pdf
+import pikepdf
+from ocrmypdf._graft import OcrGrafter
+from ocrmypdf.hocrtransform import HocrTransform
+
+from benchmarks.samples import page_image
+from graft import ChunkedGrafter
+
+# Small pages keep building the inputs quick; the point is the number of
+# pages, not their size
+PAGE_SIZE = (425, 550)
+
+HOCR = """<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head><title></title><meta name="ocr-system" content="tesseract 5.3.0" /></head>
+<body><div class="ocr_page" id="page_1" title="bbox 0 0 {w} {h}; ppageno 0">
+<div class="ocr_carea" id="block_1_1" title="bbox 10 10 200 60">
+<p class="ocr_par" id="par_1_1" lang="eng" title="bbox 10 10 200 60">
+<span class="ocr_line" id="line_1_1" title="bbox 10 10 200 60; baseline 0 0">
+<span class="ocrx_word" id="word_1_1" title="bbox 10 10 200 60; x_wconf 95">Page</span>
+</span></p></div></div></body></html>"""
+
+GRAFTERS = {
+    "OcrGrafter": OcrGrafter,
+    "ChunkedGrafter": ChunkedGrafter,
+}
+
+
+def make_document(path, pages):
+    """
+    A PDF of pages distinct images, like scanner output
+    """
+    images = []
+    for n in range(pages):
+        buffer = io.BytesIO()
+        page_image(f"Page {n + 1}", PAGE_SIZE).save(buffer, format="PNG", dpi=(50, 50))
+        images.append(buffer.getvalue())
+    with open(path, "wb") as f:
+        f.write(img2pdf.convert(images))
+    return path
+
+
+def make_page_layers(tmp):
+    """
+    The rasterized image page and the text layer the pipeline would graft
+    """
+    image_page = os.path.join(tmp, "image_page.pdf")
+    buffer = io.BytesIO()
+    page_image("Rasterized", PAGE_SIZE).save(buffer, format="PNG", dpi=(50, 50))
+    with open(image_page, "wb") as f:
+        f.write(img2pdf.convert(buffer.getvalue()))
+
+    hocr = Path(tmp, "page.hocr")
+    hocr.write_text(HOCR.format(w=PAGE_SIZE[0], h=PAGE_SIZE[1]))
+    text_page = Path(tmp, "text_page.pdf")
+    HocrTransform(hocr_filename=hocr, dpi=50).to_pdf(out_filename=text_page)
+    return Path(image_page), text_page
+
+
+def make_context(document, work_dir):
+    """
+    The parts of ocrmypdf's PdfContext the grafters use
+    """
+    with pikepdf.open(document) as pdf:
+        pdfinfo = [SimpleNamespace(rotation=0) for _ in pdf.pages]
+    return SimpleNamespace(
+        origin=Path(document),
+        pdfinfo=pdfinfo,
+        options=SimpleNamespace(redo_ocr=False, keep_temporary_files=False),
+        get_path=lambda name: Path(work_dir, name),
+    )
+
+
+def bench(grafter_class, document, layers, tmp):
+    work_dir = tempfile.mkdtemp(dir=tmp)
+    context = make_context(document, work_dir)
+    image_page, text_page = layers
+
+    start = time.perf_counter()
+    grafter = grafter_class(context)
+    for pageno in range(len(context.pdfinfo)):
+        grafter.graft_page(
+            pageno=pageno,
+            image=image_page,
+            textpdf=text_page,
+            autorotate_correction=0,
+        )
+    output = grafter.finalize()
+    elapsed = time.perf_counter() - start
+
+    with pikepdf.open(output) as pdf:
+        assert len(pdf.pages) == len(context.pdfinfo)
+    return elapsed, os.path.getsize(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, nargs="+", default=[1000, 5000, 10000])
+    parser.add_argument("--grafters", nargs="+", choices=GRAFTERS, default=GRAFTERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        layers = make_page_layers(tmp)
+        for pages in args.pages:
+            document = make_document(os.path.join(tmp, f"doc-{pages}.pdf"), pages)
+            for name in args.grafters:
+                elapsed, size = bench(GRAFTERS[name], document, layers, tmp)
+                print(
+                    f"{pages:>6} pages  {name:>14}: {elapsed:8.2f}s  "
+                    f"{elapsed / pages * 1000:6.2f}ms/page  "
+                    f"output {size / 1024**2:.1f} MB"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Serialization cost of the page tasks: ocrmypdf's PageContext vs PageWork.
+
+Analyses a synthetic document as the pipeline does and pickles the task of
+every page both ways, as a process pool does on submission, then unpickles
+it, as the page worker does. A PageContext brings the job's options and
+plugin manager with each page; a PageWork only the page's own part, with
+the job's state loaded once per worker (reported separately).
+
+    python -m benchmarks.bench_page_pickle --pages 5000
+"""
+import argparse
+import os
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+from ocrmypdf._jobcontext import PdfContext
+from ocrmypdf._plugin_manager import get_plugin_manager
+from ocrmypdf.api import create_options
+from ocrmypdf.cli import get_parser
+from ocrmypdf.pdfinfo import PdfInfo
+
+import page_work
+from benchmarks.bench_graft import make_document
+from ocr_plugins import PLUGINS
+
+
+def make_context(document, work_dir):
+    plugin_manager = get_plugin_manager(PLUGINS)
+    options = create_options(
+        input_file=document,
+        output_file=os.path.join(work_dir, "output.pdf"),
+        parser=get_parser(),
+        force_ocr=True,
+    )
+    pdfinfo = PdfInfo(document, progbar=False)
+    return PdfContext(options, Path(work_dir), Path(document), pdfinfo, plugin_manager)
+
+
+def bench(tasks):
+    """
+    Bytes per task, and milliseconds per task to pickle and to unpickle
+    """
+    start = time.perf_counter()
+    data = [pickle.dumps(task, protocol=pickle.HIGHEST_PROTOCOL) for task in tasks]
+    dumped = time.perf_counter()
+    for blob in data:
+        pickle.loads(blob)
+    loaded = time.perf_counter()
+    return (
+        sum(map(len, data)) / len(tasks),
+        (dumped - start) * 1000 / len(tasks),
+        (loaded - dumped) * 1000 / len(tasks),
+    )
+
+
+def report(name, results):
+    size, dump_ms, load_ms = results
+    print(
+        f"{name:>12}: {size:8.0f} bytes/task  pickle {dump_ms:6.3f}ms  "
+        f"unpickle {load_ms:6.3f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=5000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        document = make_document(os.path.join(tmp, "doc.pdf"), args.pages)
+        context = make_context(document, tmp)
+        page_contexts = list(context.get_page_contexts())
+
+        report("PageContext", bench([(pc,) for pc in page_contexts]))
+        with page_work.JobState(context, page_contexts) as job_state:
+            tasks = [(page,) for page in job_state.page_work()]
+            report("PageWork", bench(tasks))
+            # What a worker started without the job's state loads once
+            start = time.perf_counter()
+            with open(job_state.path, "rb") as f:
+                pickle.load(f)
+            print(
+                f"{'job state':>12}: {os.path.getsize(job_state.path):8d} bytes once "
+                f"per worker, loaded in {(time.perf_counter() - start) * 1000:.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Requests per second for small PDFs: Flask dev server vs gunicorn.
+
+Starts the backend with `python app.py` and with gunicorn.conf.py, sends one
+small PDF to /process-pdf to fill the result cache, then has several clients
+post the same PDF over keep-alive connections for a while. Every request
+still goes through upload, triage, the result cache and the download, so the
+numbers measure the serving path rather than the OCR.
+
+    python -m benchmarks.bench_serving --clients 16 --seconds 20
+"""
+import argparse
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.samples import make_scanned_pdf
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    "dev server": [sys.executable, "app.py"],
+    "gunicorn": [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+}
+
+
+def post_pdf(conn, body):
+    conn.request(
+        "POST",
+        "/process-pdf",
+        body=body,
+        headers={"Content-Type": "application/pdf", "X-Filename": "small.pdf"},
+    )
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def wait_until_ready(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/stats")
+            stats = json.loads(conn.getresponse().read())
+            conn.close()
+            return stats
+        except (OSError, ValueError):
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def load(port, body, clients, seconds):
+    """
+    Post body from several clients for a number of seconds; returns the
+    latency of each successful request and the number of failures
+    """
+    latencies, failures = [], []
+    deadline = time.monotonic() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                status = post_pdf(conn, body)
+            except OSError:
+                conn.close()
+                status = None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+            else:
+                failures.append(status)
+        conn.close()
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, len(failures)
+
+
+def bench(name, command, port, body, args, tmp):
+    env = dict(
+        os.environ,
+        PDFOCR_BIND=f"127.0.0.1:{port}",
+        PDFOCR_DATA_DIR=os.path.join(tmp, f"data-{port}"),
+        PDFOCR_WEB_WORKERS=str(args.web_workers),
+    )
+    server = subprocess.Popen(
+        command,
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        wait_until_ready(port)
+        # The first request does the OCR and fills the result cache
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=600)
+        if post_pdf(conn, body) != 200:
+            raise RuntimeError(f"{name}: the priming request failed")
+        conn.close()
+
+        latencies, failures = load(port, body, args.clients, args.seconds)
+    finally:
+        os.killpg(server.pid, signal.SIGTERM)
+        server.wait()
+
+    latencies.sort()
+    print(
+        f"{name:>12}: {len(latencies) / args.seconds:7.1f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000:.1f}ms  "
+        f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f}ms  "
+        f"({failures} failed)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--web-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--port", type=int, default=5100)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = make_scanned_pdf(os.path.join(tmp, "small.pdf"), args.pages)
+        with open(input_path, "rb") as f:
+            body = f.read()
+
+        for offset, (name, command) in enumerate(SERVERS.items()):
+            bench(name, command, args.port + offset, body, args, tmp)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Per-request start-up overhead: ocrmypdf CLI process vs warm worker pool.
+
+Runs the same short documents through a fresh `ocrmypdf` process each time
+(the old behaviour of app.py) and through ocr_worker's warm processes, and
+prints the wall time per document for both.
+
+    python -m benchmarks.bench_startup --documents 10 --pages 1
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ocr_worker
+from benchmarks.samples import make_scanned_pdf
+
+
+def run_cli(input_path, output_path):
+    subprocess.run(
+        ["ocrmypdf", "--force-ocr", "--quiet", input_path, output_path],
+        check=True,
+        capture_output=True,
+    )
+
+
+def summarize(label, timings):
+    print(
+        f"{label:>12}: mean {statistics.mean(timings):.3f}s  "
+        f"median {statistics.median(timings):.3f}s  "
+        f"min {min(timings):.3f}s  ({len(timings)} documents)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_path = make_scanned_pdf(os.path.join(tmp, "in.pdf"), args.pages)
+        output_path = os.path.join(tmp, "out.pdf")
+
+        cli = []
+        for _ in range(args.documents):
+            start = time.perf_counter()
+            run_cli(input_path, output_path)
+            cli.append(time.perf_counter() - start)
+
+        warm, startup = [], []
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=ocr_worker.get_context(),
+            initializer=ocr_worker.init_worker,
+        ) as pool:
+            warmup = pool.submit(ocr_worker.ping).result()
+            for n in range(args.documents):
+                start = time.perf_counter()
+                stats = pool.submit(
+                    ocr_worker.run_ocr,
+                    f"bench-{n}",
+                    input_path,
+                    output_path,
+                    time.time(),
+                ).result()
+                warm.append(time.perf_counter() - start)
+                startup.append(stats["startup_seconds"])
+
+    summarize("CLI", cli)
+    summarize("warm worker", warm)
+    print(f"one-time worker warm-up: {warmup:.3f}s")
+    print(f"per-request start-up with warm workers: {statistics.mean(startup):.4f}s")
+    print(
+        "estimated start-up saved per request: "
+        f"{statistics.mean(cli) - statistics.mean(warm):.3f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Per-page OCR time on short pages: tesseract program vs resident tesseract.
+
+OCRs the same short page images with ocrmypdf's TesseractOcrEngine, which
+starts the tesseract program for each page, and with
+ResidentTesseractEngine, which loads tesseract once per worker (needs
+tesserocr). Pages with a single line of text take tesseract almost no time
+to recognize, so the difference is the per-page overhead of loading it.
+
+    python -m benchmarks.bench_tesseract --pages 20 --language spa+eng
+"""
+import argparse
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from ocrmypdf.builtin_plugins.tesseract_ocr import TesseractOcrEngine
+
+from benchmarks.samples import page_image
+from ocr_plugins.resident_tesseract import ResidentTesseractEngine, tesserocr
+
+# A strip with one line of text, like a receipt or a form field
+PAGE_SIZE = (1275, 150)
+
+
+def make_options(language):
+    """
+    The parts of ocrmypdf's options the engines use
+    """
+    return SimpleNamespace(
+        languages=language.split("+"),
+        tesseract_oem=None,
+        tesseract_config=[],
+        tesseract_timeout=180.0,
+        tesseract_pagesegmode=None,
+        tesseract_thresholding=0,
+        user_words=None,
+        user_patterns=None,
+    )
+
+
+def bench(engine, images, options, tmp):
+    timings = []
+    for n, image in enumerate(images):
+        output_hocr = Path(tmp, f"{type(engine).__name__}-{n}.hocr")
+        output_text = output_hocr.with_suffix(".txt")
+        start = time.perf_counter()
+        engine.generate_hocr(image, output_hocr, output_text, options)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--language", default="eng")
+    args = parser.parse_args()
+    if tesserocr is None:
+        parser.error("tesserocr is not installed (pip install -e .[resident])")
+
+    options = make_options(args.language)
+    with tempfile.TemporaryDirectory() as tmp:
+        images = []
+        for n in range(args.pages):
+            path = Path(tmp, f"page-{n}.png")
+            page_image(f"Page {n + 1}", PAGE_SIZE).save(path, dpi=(150, 150))
+            images.append(path)
+
+        for engine in (TesseractOcrEngine(), ResidentTesseractEngine()):
+            timings = bench(engine, images, options, tmp)
+            # The first page of the resident engine includes loading it
+            print(
+                f"{type(engine).__name__:>24}: first {timings[0] * 1000:7.1f}ms  "
+                f"then median {statistics.median(timings[1:]) * 1000:7.1f}ms/page"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Worker process cost per call: ocrmypdf's StandardExecutor vs WindowedExecutor.
+
+Makes the same executor call several times with worker processes
+(use_threads=False), as a job does for triage and for its pages, once with
+ocrmypdf's executor, which starts a pool for every call, and once with
+WindowedExecutor, which keeps its preloaded pool between calls. Each task
+imports the page stages and runs the garbage collector, as a page worker
+does sooner or later, and reports how much of the worker's memory is its
+own (Linux only) rather than shared with the process it was forked from.
+
+    python -m benchmarks.bench_worker_pool --calls 5 --workers 4
+"""
+import argparse
+import gc
+import os
+import statistics
+import time
+
+from ocrmypdf.builtin_plugins.concurrency import StandardExecutor
+
+from ocr_plugins.executor import WindowedExecutor
+
+
+def private_bytes():
+    """
+    Memory of this process not shared with any other, or 0 if unknown
+    """
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+    except OSError:
+        return 0
+    return sum(
+        int(fields[name].split()[0]) * 1024
+        for name in ("Private_Clean", "Private_Dirty")
+    )
+
+
+def page_task(n):
+    import ocr_pipeline  # noqa: F401
+
+    gc.collect()
+    return os.getpid(), private_bytes()
+
+
+def bench(executor, calls, workers):
+    timings, pids, private = [], set(), []
+
+    def finished(result, pbar):
+        pid, size = result
+        pids.add(pid)
+        private.append(size)
+
+    for _ in range(calls):
+        start = time.perf_counter()
+        executor(
+            use_threads=False,
+            max_workers=workers,
+            progress_kwargs={},
+            task=page_task,
+            task_arguments=[(n,) for n in range(workers * 2)],
+            task_finished=finished,
+        )
+        timings.append(time.perf_counter() - start)
+    return timings, len(pids), statistics.mean(private)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--calls", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    # The job process has the libraries imported before its first call
+    import ocr_pipeline  # noqa: F401
+
+    for executor in (StandardExecutor(), WindowedExecutor()):
+        timings, processes, private = bench(executor, args.calls, args.workers)
+        print(
+            f"{type(executor).__name__:>16}: first call {timings[0]:6.3f}s  "
+            f"then {statistics.mean(timings[1:] or timings):6.3f}s/call  "
+            f"{processes} processes  {private / 1024**2:6.1f} MB private/worker"
+        )
+
+
+if __name__ == "__main__":
+    main()
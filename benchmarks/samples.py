@@ -0,0 +1,36 @@
+"""
+Synthetic PDFs for the benchmarks
+"""
+import io
+
+import img2pdf
+from PIL import Image, ImageDraw
+
+PAGE_SIZE = (1275, 1650)  # US Letter at 150 DPI
+
+
+def page_image(text, size=PAGE_SIZE, mode="L"):
+    """
+    A scanned-looking page: white background with a few lines of text
+    """
+    image = Image.new(mode, size, "white")
+    draw = ImageDraw.Draw(image)
+    for line in range(20):
+        draw.text((100, 100 + line * 60), f"{text} - line {line + 1}", fill="black")
+    return image
+
+
+def make_scanned_pdf(path, pages, size=PAGE_SIZE, mode="L"):
+    """
+    Write a PDF with one full-page image per page, like scanner output
+    """
+    images = []
+    for n in range(pages):
+        buffer = io.BytesIO()
+        page_image(f"Page {n + 1}", size, mode).save(
+            buffer, format="PNG", dpi=(150, 150)
+        )
+        images.append(buffer.getvalue())
+    with open(path, "wb") as f:
+        f.write(img2pdf.convert(images))
+    return path
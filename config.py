@@ -0,0 +1,121 @@
+"""
+Service settings, read from environment variables so the same code can run
+on a laptop and on the OCR nodes without edits.
+"""
+import os
+import tempfile
+
+# Number of OCR jobs processed at the same time
+OCR_WORKERS = int(os.environ.get("PDFOCR_WORKERS", "2"))
+
+# CPU tokens shared by the OCR jobs of one server process: each job runs with
+# one page worker per token it gets. 0 means the CPUs available divided among
+# the server processes
+CPU_BUDGET = int(os.environ.get("PDFOCR_CPU_BUDGET", "0"))
+
+# Memory-backed directory (tmpfs) for the intermediate files of each job, and
+# the bytes a job may keep there before its larger files are moved to disk.
+# Without a directory, or with 0 bytes, they go to the temporary directory
+MEMORY_WORK_DIR = os.environ.get(
+    "PDFOCR_MEMORY_WORK_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else ""
+)
+MEMORY_WORK_BYTES = int(
+    os.environ.get("PDFOCR_MEMORY_WORK_BYTES", str(512 * 1024**2))
+)
+
+# Pages of a job OCR'd or waiting to be grafted at once; each holds its
+# rasters in the work folder and its context in memory, so this bounds both
+# whatever the page count. 0 means two per page worker
+PAGE_WINDOW = int(os.environ.get("PDFOCR_PAGE_WINDOW", "0"))
+
+# Consecutive pages rasterized by one ghostscript process; 0 or 1 leaves each
+# page to its own, as ocrmypdf does
+RASTER_BATCH_PAGES = int(os.environ.get("PDFOCR_RASTER_BATCH_PAGES", "8"))
+
+# Seconds a page worker waits for its page's batch image before it
+# rasterizes the page itself
+RASTER_WAIT_SECONDS = float(os.environ.get("PDFOCR_RASTER_WAIT_SECONDS", "300"))
+
+# Process a job's pages in worker processes instead of threads of the job's
+# process; the workers are started once, with the OCR libraries preloaded,
+# and kept for the jobs that follow
+PAGE_PROCESSES = os.environ.get("PDFOCR_PAGE_PROCESSES", "0") == "1"
+
+# OCR pages with a tesseract kept loaded in each page worker, when tesserocr
+# is installed; 0 runs the tesseract program for every page
+RESIDENT_TESSERACT = os.environ.get("PDFOCR_RESIDENT_TESSERACT", "1") == "1"
+
+# Order in which a job's pages are OCR'd: "largest" hands the pages expected
+# to take longest to the page workers first, "document" keeps document order.
+# Streamed jobs always keep document order
+PAGE_ORDER = os.environ.get("PDFOCR_PAGE_ORDER", "largest")
+
+# Server processes sharing the machine; gunicorn.conf.py sets it for its
+# workers
+SERVER_PROCESSES = 1
+
+# Jobs allowed to wait for a worker before new uploads are rejected
+OCR_QUEUE_SIZE = int(os.environ.get("PDFOCR_QUEUE_SIZE", "50"))
+
+# Where each job keeps its input and output files
+DATA_DIR = os.environ.get(
+    "PDFOCR_DATA_DIR", os.path.join(tempfile.gettempdir(), "pdfocr")
+)
+
+# Seconds a finished job (and its result) is kept before being removed
+JOB_TTL = int(os.environ.get("PDFOCR_JOB_TTL", "3600"))
+
+# ocrmypdf settings applied to every job
+OCR_LANGUAGE = os.environ.get("PDFOCR_LANGUAGE", "eng")
+OCR_OPTIMIZE = int(os.environ.get("PDFOCR_OPTIMIZE", "1"))
+OCR_OUTPUT_TYPE = os.environ.get("PDFOCR_OUTPUT_TYPE", "pdfa")
+
+# Cache of finished results, reused when the same PDF is uploaded again
+CACHE_DIR = os.environ.get("PDFOCR_CACHE_DIR", os.path.join(DATA_DIR, "cache"))
+# Size limit of the cache in bytes; 0 disables it
+CACHE_MAX_BYTES = int(os.environ.get("PDFOCR_CACHE_MAX_BYTES", str(2 * 1024**3)))
+
+# Cache of OCR'd pages, so re-submitted documents only OCR the pages that changed
+PAGE_CACHE_DIR = os.environ.get(
+    "PDFOCR_PAGE_CACHE_DIR", os.path.join(DATA_DIR, "page-cache")
+)
+# Size limit of the page cache in bytes; 0 disables it
+PAGE_CACHE_MAX_BYTES = int(
+    os.environ.get("PDFOCR_PAGE_CACHE_MAX_BYTES", str(4 * 1024**3))
+)
+
+# Largest accepted upload in bytes, enforced while the body is streamed
+MAX_UPLOAD_BYTES = int(os.environ.get("PDFOCR_MAX_UPLOAD_BYTES", str(1024**3)))
+# Size of the chunks uploads are written to disk with
+UPLOAD_CHUNK_SIZE = int(os.environ.get("PDFOCR_UPLOAD_CHUNK_SIZE", str(1024**2)))
+
+# Resumable uploads: where they are assembled, the size of each chunk the
+# client sends, and seconds an idle upload is kept before being removed
+UPLOAD_DIR = os.environ.get("PDFOCR_UPLOAD_DIR", os.path.join(DATA_DIR, "uploads"))
+RESUMABLE_CHUNK_SIZE = int(
+    os.environ.get("PDFOCR_RESUMABLE_CHUNK_SIZE", str(8 * 1024**2))
+)
+UPLOAD_TTL = int(os.environ.get("PDFOCR_UPLOAD_TTL", "86400"))
+
+# Seconds between keep-alive comments on idle /jobs/<id>/events streams
+EVENTS_KEEPALIVE = int(os.environ.get("PDFOCR_EVENTS_KEEPALIVE", "15"))
+
+# Pages per file when a job publishes its pages as they are finished
+# (POST /jobs?stream=1)
+STREAM_RANGE_PAGES = int(os.environ.get("PDFOCR_STREAM_RANGE_PAGES", "10"))
+
+# Address the server listens on
+BIND = os.environ.get("PDFOCR_BIND", "0.0.0.0:5000")
+
+# Production server (gunicorn.conf.py): server processes, threads per process
+# (each upload, download or event stream holds one), seconds before a silent
+# process is restarted, seconds processes get to finish their work on reload
+# or shutdown, and seconds idle keep-alive connections are kept open
+WEB_WORKERS = int(os.environ.get("PDFOCR_WEB_WORKERS", "2"))
+WEB_THREADS = int(os.environ.get("PDFOCR_WEB_THREADS", "16"))
+WEB_TIMEOUT = int(os.environ.get("PDFOCR_WEB_TIMEOUT", "60"))
+GRACEFUL_TIMEOUT = int(os.environ.get("PDFOCR_GRACEFUL_TIMEOUT", "300"))
+KEEPALIVE = int(os.environ.get("PDFOCR_KEEPALIVE", "5"))
+
+# Seconds /process-pdf waits for the OCR before answering 504; 0 waits forever
+REQUEST_TIMEOUT = int(os.environ.get("PDFOCR_REQUEST_TIMEOUT", "600"))
@@ -0,0 +1,307 @@
+"""
+Assembly of the OCR'd pages into the output PDF.
+
+ocrmypdf's OcrGrafter grafts every page into one copy of the input PDF and,
+to keep its memory in check, saves and reopens that whole file every 100
+pages, so a document of n pages is rewritten n / 100 times and the graft
+phase grows with the square of the page count. ChunkedGrafter grafts the
+pages onto blank stand-ins of the input's pages in small chunk PDFs
+instead, so the chunks hold only what OCR adds (text layers and rasterized
+pages), and saves each chunk once, when its last page arrives. At the end
+it applies the stand-ins to the input's own page objects and saves the
+document once. What OCR adds is written twice whatever the size of the
+document, and only the chunks that still have pages in flight are in
+memory; the input's pages keep their objects, so links, outlines and form
+fields that point at them, and resources they share, are left as they are.
+
+PageAssembler runs the grafting on a thread of its own, so the thread that
+collects results from the OCR workers is not held up by it.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+from ocrmypdf._graft import (
+    OcrGrafter,
+    RenderMode,
+    _ensure_dictionary,
+    _update_resources,
+    strip_invisible_text,
+)
+from pikepdf import Array, Dictionary, Name, Page, Pdf
+
+logger = logging.getLogger(__name__)
+
+CHUNK_PAGES = 100
+
+
+class _Chunk:
+    """
+    Stand-ins for pages first to last (0-based, exclusive) being grafted in
+    their own PDF
+    """
+
+    def __init__(self, index, first, last, origin, pdfinfo):
+        # origin is the list of the input's pages
+        self.index = index
+        self.first = first
+        self.last = last
+        self.remaining = last - first
+        self.pdf = Pdf.new()
+        for page in origin[first:last]:
+            # All the grafting needs of the page is its size
+            self.pdf.pages.append(
+                Page(
+                    self.pdf.make_indirect(
+                        Dictionary(
+                            Type=Name.Page,
+                            MediaBox=Array(page.mediabox),
+                            Contents=self.pdf.make_stream(b""),
+                            Resources=Dictionary(),
+                        )
+                    )
+                )
+            )
+        self.pdfinfo = [pdfinfo[pageno] for pageno in range(first, last)]
+        self.font = None
+        self.font_key = None
+        # Pages replaced by a rasterized image, which the stand-in then holds
+        self.replaced = set()
+
+
+def _apply(pdf, page, stand_in, render_mode, strip_old_text, copy):
+    """
+    Do to page of pdf what grafting did to its stand-in, a page that only
+    has the text layer; copy brings the stand-in's objects into pdf
+    """
+    resources = stand_in.obj.get(Name.Resources, {})
+    xobjects = resources.get(Name.XObject, {})
+    if xobjects:
+        if strip_old_text:
+            strip_invisible_text(pdf, page)
+        page_xobjects = _ensure_dictionary(
+            _ensure_dictionary(page.obj, Name.Resources), Name.XObject
+        )
+        for name, xobject in xobjects.items():
+            page_xobjects[Name(name)] = copy(xobject)
+        for name, font in resources.get(Name.Font, {}).items():
+            _update_resources(obj=page.obj, font=copy(font), font_key=Name(name))
+        page.contents_coalesce()
+        if render_mode == RenderMode.ON_TOP:
+            original = page.Contents.read_bytes()
+            page.Contents.write(b"q\n" + original + b"\nQ\n")
+        page.contents_add(
+            copy(stand_in.Contents), prepend=render_mode == RenderMode.UNDERNEATH
+        )
+        page.contents_coalesce()
+    page.Rotate = stand_in.Rotate
+
+
+class ChunkedGrafter(OcrGrafter):
+    """
+    OcrGrafter that assembles the document from chunks of chunk_pages pages.
+
+    page_grafted(pageno, page), if given, is called with each page as soon
+    as it is complete, before its chunk is saved.
+    """
+
+    def __init__(self, context, chunk_pages=CHUNK_PAGES, page_grafted=None):
+        super().__init__(context)
+        self.chunk_pages = chunk_pages
+        self.page_grafted = page_grafted
+        self._origin = self.pdf_base
+        self._origin_pdfinfo = self.pdfinfo
+        # Indexing a PdfPages looks up the whole page tree every time
+        self._origin_pages = list(self._origin.pages)
+        self._chunks = {}
+        self._saved = {}
+        self._replaced = {}
+
+    def graft_page(self, *, pageno, image, textpdf, autorotate_correction):
+        chunk = self._get_chunk(pageno // self.chunk_pages)
+        offset = pageno - chunk.first
+        if image is not None and Path(image).resolve() != self.path_base:
+            chunk.replaced.add(offset)
+        # OcrGrafter works on self.pdf_base and finds the page's details in
+        # self.pdfinfo; point both at the chunk while the page is grafted.
+        # The stand-in has no content of its own, so the text layer goes
+        # underneath whatever the mode: _apply places it
+        render_mode = self.render_mode
+        self.pdf_base, self.pdfinfo = chunk.pdf, chunk.pdfinfo
+        self.font, self.font_key = chunk.font, chunk.font_key
+        self.render_mode = RenderMode.UNDERNEATH
+        try:
+            super().graft_page(
+                pageno=offset,
+                image=image,
+                textpdf=textpdf,
+                autorotate_correction=autorotate_correction,
+            )
+        finally:
+            chunk.font, chunk.font_key = self.font, self.font_key
+            self.pdf_base, self.pdfinfo = self._origin, self._origin_pdfinfo
+            self.render_mode = render_mode
+
+        if self.page_grafted is not None:
+            self.page_grafted(pageno, self._preview(chunk, offset))
+        chunk.remaining -= 1
+        if chunk.remaining == 0:
+            self._save_chunk(chunk)
+
+    def _preview(self, chunk, offset):
+        """
+        The grafted page, in the chunk's PDF, as it will be in the output
+        """
+        stand_in = chunk.pdf.pages[offset]
+        if offset in chunk.replaced:
+            return stand_in
+        # A copy of the input's page, grafted the same way and removed again
+        # so that it is not saved with the chunk
+        chunk.pdf.pages.append(self._origin_pages[chunk.first + offset])
+        preview = chunk.pdf.pages[-1]
+        _apply(
+            chunk.pdf,
+            preview,
+            stand_in,
+            self.render_mode,
+            self.context.options.redo_ocr,
+            copy=lambda obj: obj,
+        )
+        del chunk.pdf.pages[-1]
+        return preview
+
+    def save_and_reload(self):
+        # Chunks already bound the memory in use
+        pass
+
+    def _get_chunk(self, index):
+        chunk = self._chunks.get(index)
+        if chunk is None:
+            first = index * self.chunk_pages
+            last = min(first + self.chunk_pages, len(self._origin_pages))
+            chunk = _Chunk(index, first, last, self._origin_pages, self._origin_pdfinfo)
+            self._chunks[index] = chunk
+        return chunk
+
+    def _save_chunk(self, chunk):
+        path = self.context.get_path(f"graft_chunk{chunk.index:06d}.pdf")
+        chunk.pdf.save(path)
+        chunk.pdf.close()
+        del self._chunks[chunk.index]
+        self._saved[chunk.index] = path
+        self._replaced[chunk.index] = chunk.replaced
+        logger.debug(f"Saved pages {chunk.first + 1}-{chunk.last}")
+
+    def finalize(self):
+        """
+        Apply the grafted stand-ins to the input's pages and save the
+        document once
+        """
+        # Every page is grafted before finalizing, but be safe if not
+        for chunk in list(self._chunks.values()):
+            self._save_chunk(chunk)
+
+        strip_old_text = self.context.options.redo_ocr
+        chunks = []
+        try:
+            for index, path in sorted(self._saved.items()):
+                chunk = Pdf.open(path)
+                chunks.append(chunk)
+                first = index * self.chunk_pages
+                for offset, stand_in in enumerate(chunk.pages):
+                    page = self._origin_pages[first + offset]
+                    if offset in self._replaced[index]:
+                        # As OcrGrafter does, the rasterized page takes the
+                        # place of the input's in the same page object
+                        # (qpdf does not follow /Parent when copying a page)
+                        page.emplace(
+                            Page(self._origin.copy_foreign(stand_in.obj)),
+                            retain=(Name.Parent,),
+                        )
+                    else:
+                        _apply(
+                            self._origin,
+                            page,
+                            stand_in,
+                            self.render_mode,
+                            strip_old_text,
+                            copy=self._origin.copy_foreign,
+                        )
+            self._origin.save(self.output_file)
+        finally:
+            self._origin.close()
+            for chunk in chunks:
+                chunk.close()
+        return self.output_file
+
+    def remove_chunks(self):
+        """
+        Delete the chunk files once the document is saved
+        """
+        for path in self._saved.values():
+            # A chunk moved to disk is a symlink to it (see workfolder)
+            if os.path.islink(path):
+                os.remove(os.path.realpath(path))
+            os.remove(path)
+        self._saved = {}
+
+
+class PageAssembler:
+    """
+    Runs submitted calls in order on an assembly thread, fed through a queue
+    of at most maxsize calls.
+
+    When the queue is full, submit waits: blocked_seconds adds up that time,
+    during which OCR results are not collected, and busy_seconds the time
+    spent running the calls. An exception raised by a call is raised again
+    by the next submit or on leaving the with block.
+    """
+
+    def __init__(self, maxsize):
+        self.blocked_seconds = 0.0
+        self.busy_seconds = 0.0
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="page-assembly")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._queue.put(None)
+        self._thread.join()
+        if exc_type is None:
+            self._raise_error()
+        return False
+
+    def submit(self, fn, *args):
+        self._raise_error()
+        try:
+            self._queue.put_nowait((fn, args))
+        except queue.Full:
+            start = time.perf_counter()
+            self._queue.put((fn, args))
+            self.blocked_seconds += time.perf_counter() - start
+
+    def _raise_error(self):
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            if self._error is not None:
+                continue  # Keep draining so that submit never waits forever
+            fn, args = item
+            start = time.perf_counter()
+            try:
+                fn(*args)
+            except Exception as e:
+                self._error = e
+            self.busy_seconds += time.perf_counter() - start
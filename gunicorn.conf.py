@@ -0,0 +1,54 @@
+"""
+gunicorn settings for production: gunicorn -c gunicorn.conf.py app:app
+
+Several server processes with a pool of threads each. Job state lives in the
+data directory, so any process can answer for any job; each process runs the
+OCR of the jobs it accepted in its own pool of PDFOCR_WORKERS processes.
+
+Send SIGHUP to the master process for a graceful reload: new processes are
+started and the old ones stop taking requests and get PDFOCR_GRACEFUL_TIMEOUT
+seconds to finish their OCR jobs.
+"""
+# Every module-level name here is read as a gunicorn setting, and "config"
+# is one of them
+import config as settings
+
+bind = settings.BIND
+workers = settings.WEB_WORKERS
+# Threads, not one request per process: uploads, event streams and
+# /process-pdf spend most of their time waiting
+worker_class = "gthread"
+threads = settings.WEB_THREADS
+timeout = settings.WEB_TIMEOUT
+graceful_timeout = settings.GRACEFUL_TIMEOUT
+keepalive = settings.KEEPALIVE
+# Every process needs its own OCR pool and threads, so the app must not be
+# imported before forking
+preload_app = False
+
+
+def post_fork(server, worker):
+    """
+    Tell the app how many processes share the CPUs (see admission), before
+    it is imported
+    """
+    settings.SERVER_PROCESSES = server.cfg.workers
+
+
+def worker_int(worker):
+    """
+    Ctrl-C: stop without waiting for the OCR jobs
+    """
+    import app
+
+    app.job_queue.shutdown(timeout=0)
+
+
+def worker_exit(server, worker):
+    """
+    Give the jobs this process accepted time to finish before it exits
+    """
+    import app
+
+    # Leave a margin before the master kills the process
+    app.job_queue.shutdown(timeout=max(0, graceful_timeout - 5))
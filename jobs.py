@@ -0,0 +1,508 @@
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import ocr_worker
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Every job keeps its state in this file in its work directory
+JOB_FILE = "job.json"
+JOB_ID = re.compile(r"[0-9a-f]{32}")
+# How often a job owned by another process is re-read while following it
+STORED_JOB_POLL = 0.5
+# Seconds between scans of the data directory for expired jobs
+SWEEP_INTERVAL = 60
+
+
+class QueueFullError(Exception):
+    """
+    Raised when every slot of the job queue is taken
+    """
+
+
+class Job:
+    """
+    A single OCR request and the files that belong to it
+    """
+
+    def __init__(self, job_id, filename, work_dir):
+        self.id = job_id
+        self.filename = filename
+        self.pages = None
+        self.work_dir = work_dir
+        self.input_path = os.path.join(work_dir, "input.pdf")
+        self.output_path = os.path.join(work_dir, "output_ocr.pdf")
+        # Finished pages are published here while the job runs (see
+        # page_stream) if the client asked for it
+        self.pages_dir = os.path.join(work_dir, "pages")
+        self.stream = False
+        self.status = QUEUED
+        self.error = None
+        self.details = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.stats = {}
+        self.progress = {}
+        self.cpu_jobs = None
+        self.cache_key = None
+        self.done = threading.Event()
+        self._version = 0
+        self._changed = threading.Condition()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED)
+
+    def publish(self, progress=None):
+        """
+        Record new progress (or just a status change), save it and wake up
+        the clients following this job
+        """
+        with self._changed:
+            if progress is not None:
+                self.progress = progress
+            self._version += 1
+            self.save()
+            self._changed.notify_all()
+
+    def save(self):
+        """
+        Write the job's state to its work directory, where every server
+        process can read it
+        """
+        data = self.to_dict()
+        data.update(
+            {
+                "version": self._version,
+                "owner": os.getpid(),
+                "error": self.error,
+                "details": self.details,
+            }
+        )
+        tmp_path = os.path.join(
+            self.work_dir, f"{JOB_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, os.path.join(self.work_dir, JOB_FILE))
+        except FileNotFoundError:
+            pass  # Discarded meanwhile
+
+    def wait_for_update(self, version, timeout):
+        """
+        Wait until the job changes after version; returns the current version,
+        which is still version if nothing happened within timeout
+        """
+        with self._changed:
+            self._changed.wait_for(lambda: self._version != version, timeout)
+            return self._version
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "filename": self.filename,
+            "pages": self.pages,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.progress,
+            "cpu_jobs": self.cpu_jobs,
+            "stream": self.stream,
+            "stats": self.stats,
+        }
+        if self.status == FAILED:
+            data["error"] = self.error
+            data["details"] = self.details
+        return data
+
+
+def _process_alive(pid):
+    if os.name != "posix":
+        return True  # os.kill would terminate the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class StoredJob(Job):
+    """
+    Read-only view of a job owned by another server process, loaded from its
+    job file.
+
+    A job whose owner died before finishing it is reported as failed.
+    """
+
+    def __init__(self, work_dir):
+        super().__init__(os.path.basename(work_dir), None, work_dir)
+        self.refresh()
+
+    def refresh(self):
+        path = os.path.join(self.work_dir, JOB_FILE)
+        with open(path) as f:
+            data = json.load(f)
+        for name in [
+            "filename",
+            "pages",
+            "status",
+            "error",
+            "details",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "progress",
+            "cpu_jobs",
+            "stream",
+            "stats",
+        ]:
+            setattr(self, name, data[name])
+        self._version = data["version"]
+        if not self.finished and not _process_alive(data["owner"]):
+            self.status = FAILED
+            self.error = "El servidor se detuvo mientras procesaba el documento"
+            self.details = "Vuelve a enviar el documento"
+            self.finished_at = os.path.getmtime(path)
+        if self.finished:
+            self.done.set()
+
+    def publish(self, progress=None):
+        raise TypeError("Jobs are only updated by the process that owns them")
+
+    def wait_for_update(self, version, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self.refresh()
+            except FileNotFoundError:
+                # Discarded by its owner
+                self.status = FAILED
+                self.error = "Trabajo no encontrado"
+                self._version += 1
+                self.done.set()
+            if self._version != version or time.monotonic() >= deadline:
+                return self._version
+            time.sleep(STORED_JOB_POLL)
+
+
+class JobQueue:
+    """
+    Bounded queue of OCR jobs served by a fixed number of worker threads.
+
+    Uploads are accepted as long as there is room in the queue, so many more
+    requests can be in flight than there are OCR workers; once the queue is
+    full new submissions are refused instead of piling up. Each worker thread
+    waits for CPU tokens from the budget (see admission) and hands its job to
+    a pool of warm OCR processes (see ocr_worker), which run it with one page
+    worker per token.
+    """
+
+    def __init__(self, workers, max_queued, data_dir, ttl, cache, budget):
+        self.workers = workers
+        self.data_dir = data_dir
+        self.ttl = ttl
+        self.cache = cache
+        self.budget = budget
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pool = None
+        self._events = None
+        self._accepting = True
+        self._last_sweep = 0
+
+    def start(self):
+        """
+        Start the OCR processes and the worker threads (only once)
+        """
+        with self._lock:
+            if self._threads:
+                return
+            self._events = ocr_worker.get_context().Queue()
+            self._pool = self._start_pool()
+            for n in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"ocr-worker-{n}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+            thread = threading.Thread(
+                target=self._forward_events, name="ocr-events", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.workers} OCR workers")
+
+    def _start_pool(self):
+        """
+        A pool of OCR processes, all of them started now instead of on the
+        first uploads
+        """
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ocr_worker.get_context(),
+            initializer=ocr_worker.init_worker,
+            initargs=(self._events,),
+        )
+        for _ in range(self.workers):
+            pool.submit(ocr_worker.ping)
+        return pool
+
+    def _replace_pool(self, broken):
+        """
+        Replace the pool broken, which lost a process (killed for memory, a
+        crash in tesseract), if it is still the current one; returns the
+        current pool
+        """
+        with self._lock:
+            if self._pool is broken and self._accepting:
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._pool = self._start_pool()
+                logger.warning("An OCR process died, started new OCR processes")
+            return self._pool
+
+    def create_job(self, filename):
+        """
+        Register a new job and create its work directory
+        """
+        self._expire()
+        job_id = uuid.uuid4().hex
+        work_dir = os.path.join(self.data_dir, job_id)
+        os.makedirs(work_dir)
+        job = Job(job_id, filename, work_dir)
+        job.save()
+        with self._lock:
+            self._jobs[job_id] = job
+        return job
+
+    def submit(self, job):
+        """
+        Queue a job whose input file is already in place.
+
+        Inputs already processed with the same options are answered from the
+        result cache without going through the queue.
+        """
+        if self.cache.enabled:
+            options = ocr_worker.effective_options()
+            job.cache_key = self.cache.key(job.input_path, options)
+            if self.cache.get(job.cache_key, job.output_path):
+                logger.info(f"Job {job.id} served from the result cache")
+                job.stats = {"cache": "hit"}
+                job.started_at = job.finished_at = time.time()
+                job.status = DONE
+                job.done.set()
+                job.publish()
+                return
+
+        self.start()
+        job.publish()
+        try:
+            if not self._accepting:
+                raise queue.Full
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self.discard(job)
+            raise QueueFullError("OCR queue is full")
+        logger.info(f"Job {job.id} queued ({self._queue.qsize()} waiting)")
+
+    def get(self, job_id):
+        """
+        The job with this id, whether this process or another one owns it
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None or not JOB_ID.fullmatch(job_id):
+            return job
+        try:
+            return StoredJob(os.path.join(self.data_dir, job_id))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def discard(self, job):
+        """
+        Forget a job and delete its files
+        """
+        with self._lock:
+            self._jobs.pop(job.id, None)
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        admission = self.budget.stats()
+        return {
+            "workers": self.workers,
+            # Waiting for a worker thread plus waiting for CPU tokens
+            "queued": self._queue.qsize() + admission["waiting"],
+            "running": sum(1 for job in jobs if job.status == RUNNING),
+            "max_queued": self._queue.maxsize,
+            "admission": admission,
+        }
+
+    def shutdown(self, timeout):
+        """
+        Stop taking jobs and give the queued and running ones up to timeout
+        seconds to finish; the rest are marked as failed so that clients are
+        told to send them again
+        """
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.done.wait(max(0, deadline - time.monotonic()))
+        for job in jobs:
+            if not job.finished:
+                job.status = FAILED
+                job.error = "El servidor se reinició mientras procesaba el documento"
+                job.details = "Vuelve a enviar el documento"
+                job.finished_at = time.time()
+                job.done.set()
+                job.publish()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+        logger.info(f"Job queue stopped, {len(jobs)} jobs in memory")
+
+    def _expire(self):
+        """
+        Remove finished jobs older than the configured TTL, including those
+        of other server processes
+        """
+        now = time.time()
+        with self._lock:
+            expired = [
+                job
+                for job in self._jobs.values()
+                if job.finished and now - job.finished_at > self.ttl
+            ]
+        if now - self._last_sweep > SWEEP_INTERVAL:
+            self._last_sweep = now
+            expired.extend(self._sweep(now))
+        for job in expired:
+            logger.debug(f"Job {job.id} expired")
+            self.discard(job)
+
+    def _sweep(self, now):
+        """
+        Expired jobs in the data directory that are not in memory
+        """
+        expired = []
+        if not os.path.isdir(self.data_dir):
+            return expired
+        for entry in os.scandir(self.data_dir):
+            if not JOB_ID.fullmatch(entry.name):
+                continue
+            with self._lock:
+                if entry.name in self._jobs:
+                    continue
+            try:
+                job = StoredJob(entry.path)
+            except (FileNotFoundError, ValueError):
+                continue
+            if job.finished and now - job.finished_at > self.ttl:
+                expired.append(job)
+        return expired
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            except Exception as e:
+                logger.exception(f"Job {job.id} crashed")
+                job.status = FAILED
+                job.error = "Error inesperado al procesar el documento"
+                job.details = str(e)
+            finally:
+                job.finished_at = time.time()
+                job.done.set()
+                job.publish()
+                self._queue.task_done()
+
+    def _forward_events(self):
+        """
+        Hand the progress reported by the OCR processes to their jobs
+        """
+        while True:
+            job_id, progress = self._events.get()
+            job = self.get(job_id)
+            if job is not None:
+                job.publish(progress)
+
+    def _run(self, job):
+        # At most one page worker per page is useful
+        job.cpu_jobs = self.budget.acquire(job.id, job.pages or self.budget.tokens)
+        try:
+            self._run_admitted(job)
+        finally:
+            self.budget.release(job.id)
+
+    def _run_admitted(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.publish()
+        logger.info(f"Job {job.id} started with {job.cpu_jobs} CPU tokens")
+        task = (
+            ocr_worker.run_ocr,
+            job.id,
+            job.input_path,
+            job.output_path,
+            time.time(),
+            job.cpu_jobs,
+            job.pages_dir if job.stream else None,
+        )
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(*task)
+            except BrokenProcessPool:
+                # Broken before this job got to it: it runs on the new pool
+                pool = self._replace_pool(pool)
+                future = pool.submit(*task)
+            job.stats = future.result()
+        except BrokenProcessPool as e:
+            # The process running this job (or another job of the pool)
+            # died; the jobs that follow get new processes
+            logger.error(f"OCR process died while running job {job.id}: {e!r}")
+            self._replace_pool(pool)
+            job.status = FAILED
+            job.error = "El proceso de OCR terminó inesperadamente"
+            job.details = "Vuelve a enviar el documento"
+            return
+        except Exception as e:
+            logger.error(f"OCR processing failed for job {job.id}: {e!r}")
+            job.status = FAILED
+            job.error = "Error procesando el PDF"
+            job.details = f"{type(e).__name__}: {e}"
+            return
+
+        logger.info(
+            f"OCR processing successful for job {job.id}: "
+            f"exit code {job.stats['exit_code']}, "
+            f"start-up {job.stats['startup_seconds']:.3f}s, "
+            f"OCR {job.stats['ocr_seconds']:.2f}s"
+        )
+        job.stats["cache"] = "miss" if job.cache_key else "disabled"
+        job.status = DONE
+        if job.cache_key:
+            self.cache.put(job.cache_key, job.output_path)
@@ -0,0 +1,330 @@
+"""
+OCR pipeline run by the workers.
+
+Adapted from ocrmypdf._pipelines.ocr (MPL-2.0). The stages are ocrmypdf's
+own; this module only drives them, so the service can decide how pages are
+scheduled, cached and assembled without patching ocrmypdf.
+"""
+import logging
+import time
+from contextlib import suppress
+from copy import copy
+from functools import partial
+from pathlib import Path
+
+import PIL
+from ocrmypdf._jobcontext import PdfContext
+from ocrmypdf._metadata import metadata_fixup
+from ocrmypdf._pipeline import (
+    convert_to_pdfa,
+    copy_final,
+    generate_postscript_stub,
+    get_pdf_save_settings,
+    merge_sidecars,
+    optimize_pdf,
+    should_linearize,
+    triage,
+    validate_pdfinfo_options,
+)
+from ocrmypdf._pipelines._common import (
+    do_get_pdfinfo,
+    manage_debug_log_handler,
+    manage_work_folder,
+    report_output_pdf,
+    set_thread_pageno,
+    setup_pipeline,
+    worker_init,
+)
+from ocrmypdf._pipelines.ocr import _exec_page_sync
+from ocrmypdf._progressbar import NullProgressBar
+from ocrmypdf._validation import check_requested_output_file, create_input_file
+
+import page_work
+from graft import ChunkedGrafter, PageAssembler
+from ocr_plugins import progress
+from ocr_plugins.batch_raster import BatchRasterizer, is_scanned_page
+from ocr_plugins.resident_tesseract import analysing
+from page_order import largest_first
+from workfolder import WorkFolder
+
+logger = logging.getLogger(__name__)
+
+
+def postprocess(pdf_file, context, executor):
+    """
+    Same steps as ocrmypdf's postprocess, reporting each as a job phase
+    """
+    pdf_out = pdf_file
+    if context.options.output_type.startswith("pdfa"):
+        progress.set_phase("pdfa")
+        ps_stub_out = generate_postscript_stub(context)
+        pdf_out = convert_to_pdfa(pdf_out, ps_stub_out, context)
+
+    progress.set_phase("optimize")
+    optimizing = context.plugin_manager.hook.is_optimization_enabled(context=context)
+    save_settings = get_pdf_save_settings(context.options.output_type)
+    save_settings["linearize"] = not optimizing and should_linearize(pdf_out, context)
+
+    pdf_out = metadata_fixup(pdf_out, context, pdf_save_settings=save_settings)
+    return optimize_pdf(pdf_out, context, executor)
+
+
+def remove_page_files(context, result):
+    """
+    Delete the intermediate files of a grafted page from the work folder: the
+    output PDF has its own copy of what it needs. The page's text is kept if
+    the job writes a sidecar, which is merged from them at the end.
+    """
+    keep = Path(result.text) if context.options.sidecar and result.text else None
+    for path in context.work_folder.glob(f"{result.pageno + 1:06d}_*"):
+        if path == keep:
+            continue
+        # On Windows a file still open cannot be deleted; it goes with the
+        # work folder
+        with suppress(OSError):
+            path.unlink()
+
+
+def exec_page(page):
+    """
+    ocrmypdf's page task for the PageWork page (see page_work), with the OCR
+    engine keeping what it finds out about the page on its PageContext (see
+    ocr_plugins.resident_tesseract). Returns the page's result and the
+    seconds the worker spent on it.
+    """
+    start = time.perf_counter()
+    page_context = page_work.page_context(page)
+    with analysing(page_context):
+        result = _exec_page_sync(page_context)
+    return result, time.perf_counter() - start
+
+
+def keep_scanned_pages(options, page_contexts):
+    """
+    Have pages that are a single image, such as scanner output, keep that
+    image in the output, with the text layer grafted on, instead of being
+    replaced by a re-encoded rendering of themselves. Returns their number.
+
+    That is ocrmypdf's lossless reconstruction, turned on for these pages
+    only; options that change how a page looks rule it out.
+    """
+    if (
+        options.lossless_reconstruction
+        or options.redo_ocr
+        or options.deskew
+        or options.clean_final
+        or options.remove_background
+    ):
+        return 0
+    page_options = copy(options)
+    page_options.lossless_reconstruction = True
+    kept = 0
+    for page_context in page_contexts:
+        if is_scanned_page(page_context.pageinfo):
+            page_context.options = page_options
+            kept += 1
+    return kept
+
+
+def exec_concurrent(context, executor, page_cache, work, stats, streamer=None):
+    """
+    Execute the OCR pipeline concurrently; with a streamer, finished pages
+    are also published in order as they are grafted (see page_stream).
+    work is the job's WorkFolder, sampled whenever it is about to shrink.
+    """
+    options = context.options
+    npages = len(context.pdfinfo)
+    sidecars = [None] * npages
+    ocrgraft = ChunkedGrafter(
+        context, page_grafted=streamer.page_done if streamer else None
+    )
+    keys = page_cache.page_keys(context) if page_cache.enabled else None
+    remove_intermediates = not options.keep_temporary_files
+
+    def graft_page(result, pbar):
+        try:
+            set_thread_pageno(result.pageno + 1)
+            sidecars[result.pageno] = result.text
+            pbar.update(0.5)
+            ocrgraft.graft_page(
+                pageno=result.pageno,
+                image=result.pdf_page_from_image,
+                textpdf=result.ocr,
+                autorotate_correction=result.orientation_correction,
+            )
+            pbar.update(0.5)
+        finally:
+            set_thread_pageno(None)
+        if remove_intermediates:
+            work.sample()
+            remove_page_files(context, result)
+
+    def update_page(result, pbar):
+        """
+        After OCR is complete for a page, cache it and update the PDF
+        """
+        if keys and keys[result.pageno]:
+            page_cache.put(keys[result.pageno], result)
+        graft_page(result, pbar)
+
+    if streamer is not None:
+        streamer.start(npages)
+
+    # Grafting runs on the assembly thread, while this thread hands pages to
+    # it as they are restored from the page cache or come back from OCR
+    with PageAssembler(maxsize=2 * options.jobs) as assembler:
+        # Pages seen before are grafted straight from the page cache
+        pending = []
+        for page_context in context.get_page_contexts():
+            key = keys[page_context.pageno] if keys else None
+            cached = key and page_cache.get(key, page_context)
+            if cached:
+                assembler.submit(graft_page, cached, NullProgressBar())
+            else:
+                pending.append(page_context)
+        stats["pages"] = npages
+        stats["pages_from_cache"] = npages - len(pending)
+        if stats["pages_from_cache"]:
+            logger.info(
+                f"{stats['pages_from_cache']} of {npages} pages restored from "
+                "page cache"
+            )
+        progress.update(pages=npages, pages_from_cache=stats["pages_from_cache"])
+
+        # Rasterizing and OCR of a page are a single task, so both are
+        # reported as the "ocr" phase
+        progress.set_phase("ocr")
+
+        stats["pages_original_image"] = keep_scanned_pages(options, pending)
+
+        # The costliest pages go first, so the job does not end with one
+        # worker on a large page while the others are idle; streamed jobs
+        # publish in document order and keep it (see page_order)
+        if streamer is None:
+            pending = largest_first(pending)
+
+        max_workers = min(len(pending), options.jobs)
+        if max_workers > 1:
+            logger.info(f"Start processing {max_workers} pages concurrently")
+
+        page_seconds = []
+
+        def page_finished(timed_result, pbar):
+            result, seconds = timed_result
+            page_seconds.append(seconds)
+            rasterizer.page_done()
+            assembler.submit(update_page, result, pbar)
+
+        # Page tasks carry only what is their page's own; the rest goes to
+        # the workers once per job
+        job_state = page_work.JobState(context, pending)
+
+        # Page images are rendered ahead in batches, one ghostscript per run
+        # of pages, and picked up by the workers (see batch_raster), planned
+        # in the order the pages are handed to the workers
+        start = time.perf_counter()
+        with job_state, BatchRasterizer(context, pending, max_workers) as rasterizer:
+            executor(
+                use_threads=options.use_threads,
+                max_workers=max_workers,
+                progress_kwargs=dict(
+                    total=len(pending),
+                    desc="OCR" if options.tesseract_timeout > 0 else "Image processing",
+                    unit="page",
+                    disable=not options.progress_bar,
+                ),
+                worker_initializer=partial(worker_init, PIL.Image.MAX_IMAGE_PIXELS),
+                task=exec_page,
+                task_arguments=[(page,) for page in job_state.page_work()],
+                task_finished=page_finished,
+            )
+        stats.update(rasterizer.stats(len(pending)))
+        # The OCR phase against the page time it got through: it cannot be
+        # shorter than the total divided among the workers, nor than the
+        # longest page
+        stats["ocr_makespan_seconds"] = time.perf_counter() - start
+        stats["page_seconds_total"] = sum(page_seconds)
+        stats["page_seconds_max"] = max(page_seconds, default=0.0)
+
+        # Whatever the assembly thread still has to graft counts as grafting
+        progress.set_phase("graft")
+
+    stats["assembly_seconds"] = assembler.busy_seconds
+    # Time the OCR results waited for the assembly thread to catch up
+    stats["assembly_blocked_seconds"] = assembler.blocked_seconds
+
+    # Output sidecar text
+    if options.sidecar:
+        text = merge_sidecars(sidecars, context)
+        # Copy text file to destination
+        copy_final(text, options.sidecar, options.input_file)
+
+    # Merge layers to one single pdf
+    pdf = ocrgraft.finalize()
+    if remove_intermediates:
+        work.sample(spill=False)
+        ocrgraft.remove_chunks()
+    # The joined document may go to disk before post-processing copies it
+    work.sample()
+
+    messages = []
+    if options.output_type != "none":
+        # PDF/A and metadata
+        logger.info("Postprocessing...")
+        pdf, messages = postprocess(pdf, context, executor)
+
+        # Copy PDF file to destination
+        progress.set_phase("output")
+        copy_final(pdf, options.output_file, options.input_file)
+    work.sample(spill=False)
+    return messages
+
+
+def run_pipeline(options, plugin_manager, page_cache, stats, streamer=None, work=None):
+    """
+    Run the OCR pipeline for one document, filling stats along the way.
+    work is where the intermediate files go, by default the temporary
+    directory.
+    """
+    work = work or WorkFolder()
+    try:
+        return _run_pipeline(options, plugin_manager, page_cache, work, stats, streamer)
+    finally:
+        work.cleanup(retain=options.keep_temporary_files)
+        stats.update(work.stats())
+
+
+def _run_pipeline(options, plugin_manager, page_cache, work, stats, streamer):
+    with (
+        manage_work_folder(
+            work_folder=work.create(),
+            retain=options.keep_temporary_files,
+            print_location=options.keep_temporary_files,
+        ) as work_folder,
+        manage_debug_log_handler(options=options, work_folder=work_folder),
+    ):
+        progress.set_phase("triage")
+        executor = setup_pipeline(options, plugin_manager)
+        check_requested_output_file(options)
+        start_input_file, original_filename = create_input_file(options, work_folder)
+
+        # Triage image or pdf
+        origin_pdf = triage(
+            original_filename, start_input_file, work_folder / "origin.pdf", options
+        )
+        # The grafter, ghostscript and the page workers read it until the end
+        work.keep(origin_pdf)
+
+        # Gather pdfinfo and create context
+        pdfinfo = do_get_pdfinfo(origin_pdf, executor, options)
+        context = PdfContext(options, work_folder, origin_pdf, pdfinfo, plugin_manager)
+
+        # Validate options are okay for this pdf
+        validate_pdfinfo_options(context)
+
+        # Execute the pipeline
+        optimize_messages = exec_concurrent(
+            context, executor, page_cache, work, stats, streamer
+        )
+
+        return report_output_pdf(options, start_input_file, optimize_messages)
@@ -0,0 +1,13 @@
+"""
+ocrmypdf plugins loaded by the OCR workers.
+
+Each module implements ocrmypdf hooks; PLUGINS lists them in the form
+ocrmypdf's plugin manager expects.
+"""
+
+PLUGINS = [
+    "ocr_plugins.progress",
+    "ocr_plugins.executor",
+    "ocr_plugins.batch_raster",
+    "ocr_plugins.resident_tesseract",
+]
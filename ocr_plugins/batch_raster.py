@@ -0,0 +1,540 @@
+"""
+Batched page rasterization with ghostscript.
+
+ocrmypdf rasterizes every page with a ghostscript process of its own, which
+parses the whole input PDF again for each page. BatchRasterizer renders runs
+of consecutive pages that need the same device and resolution with a single
+ghostscript call (-dFirstPage/-dLastPage and one output file per page), on
+threads of the job's process and a little ahead of the page workers. The
+rasterize_pdf_page hook below then hands each page worker the image of its
+page instead of starting ghostscript. Pages that were not planned, whose
+batch failed or whose image does not come within PDFOCR_RASTER_WAIT_SECONDS
+are rasterized by ocrmypdf as usual.
+
+Scanner output needs no rendering at all: when a page is a single image
+covering it at the resolution it would be rendered at, the image is decoded
+from the PDF and stands in for the rendered page. That does not depend on
+batching: with PDFOCR_RASTER_BATCH_PAGES of 0 or 1, such pages are still
+planned, one per run, and only the others are left to ocrmypdf.
+
+With rotate_pages, ocrmypdf renders every page a second time, in gray and at
+no more than 300 dpi, to detect its orientation; that preview is scaled down
+from the page's image instead. The hook records every page it leaves to
+ocrmypdf's ghostscript, so that the job can report how often each page was
+rendered.
+
+With remove_vectors, ocrmypdf renders every page twice more: once as shown
+and once without vector graphics, for OCR. Ghostscript filters vectors for a
+whole render, so a page that has them still needs both, and its runs get a
+second batch render with -dFILTERVECTOR. A page without vector graphics
+looks the same either way, and its one image serves both.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import suppress
+from pathlib import Path
+from subprocess import PIPE, CalledProcessError, run
+
+from ocrmypdf import hookimpl
+from ocrmypdf._exec.ghostscript import GS, _gs_error_reported
+from ocrmypdf._pipeline import calculate_image_dpi, get_canvas_square_dpi
+from ocrmypdf.pdfinfo import Colorspace
+from PIL import Image
+from pikepdf import Name, PdfImage, parse_content_stream
+from pikepdf import open as open_pdf
+
+import config
+from ocr_plugins.executor import page_window
+
+logger = logging.getLogger(__name__)
+
+RASTER_DIR = "raster"
+PLAN_FILE = "plan.json"
+# One line per page image the page workers produced: "page" or "preview"
+# when ghostscript rendered it, "derived" for previews scaled down here
+RENDERS_FILE = "renders"
+# Written when the rasterizer stops early, so that no worker waits for it
+STOPPED_FILE = "stopped"
+POLL_SECONDS = 0.02
+
+_COLORSPACES = ["pngmono", "pnggray", "png256", "png16m"]
+# The device ocrmypdf renders orientation previews with
+PREVIEW_DEVICE = "jpeggray"
+# The image mode ghostscript renders with each device
+_MODES = {"pngmono": "1", "pnggray": "L", "png256": "P", "png16m": "RGB"}
+# Image entries that change how the samples are painted
+_PAINT_KEYS = (Name.Decode, Name.Mask, Name.SMask, Name.ImageMask)
+
+
+def raster_device(pageinfo):
+    """
+    The ghostscript device ocrmypdf rasterizes the page with, as chosen in
+    ocrmypdf._pipeline.rasterize
+    """
+    device = 0
+    for image in pageinfo.images:
+        if image.type_ != "image" or image.bpc <= 1:
+            continue  # Masks, and 1-bit images that pngmono renders as is
+        if image.color == Colorspace.index:
+            device = max(device, _COLORSPACES.index("png256"))
+        elif image.color == Colorspace.gray:
+            device = max(device, _COLORSPACES.index("pnggray"))
+        else:
+            device = max(device, _COLORSPACES.index("png16m"))
+    if pageinfo.has_vector:
+        device = max(device, _COLORSPACES.index("png16m"))
+    return _COLORSPACES[device]
+
+
+def is_scanned_page(pageinfo):
+    """
+    Whether the page is a single image and nothing else, like scanner output
+    """
+    return (
+        len(pageinfo.images) == 1
+        and pageinfo.images[0].type_ == "image"
+        and not pageinfo.has_text
+        and not pageinfo.has_vector
+        and float(pageinfo.userunit) == 1.0
+    )
+
+
+def _native_size(page_context, device, dpi):
+    """
+    Whether the page's image has as many pixels as rendering the page would
+    give, so that it can be used as is
+    """
+    pageinfo = page_context.pageinfo
+    if not is_scanned_page(pageinfo):
+        return False
+    image = pageinfo.images[0]
+    if image.color not in (Colorspace.gray, Colorspace.rgb, Colorspace.index):
+        return False
+    return (image.width, image.height) == (
+        round(dpi.x * float(pageinfo.width_inches)),
+        round(dpi.y * float(pageinfo.height_inches)),
+    )
+
+
+def _native_image(page, device):
+    """
+    The page's image, decoded, if drawing it is all the page does and it
+    covers the page upright; otherwise None
+    """
+    images = list(page.images.values())
+    if len(images) != 1 or any(key in images[0] for key in _PAINT_KEYS):
+        return None
+    instructions = [
+        (operands, str(operator))
+        for operands, operator in parse_content_stream(page)
+        if str(operator) not in ("q", "Q")
+    ]
+    if [operator for _, operator in instructions] != ["cm", "Do"]:
+        return None
+    a, b, c, d, e, f = (float(value) for value in instructions[0][0])
+    x0, y0, x1, y1 = (float(value) for value in page.mediabox)
+    if (
+        b
+        or c
+        or max(abs(a - (x1 - x0)), abs(d - (y1 - y0)), abs(e - x0), abs(f - y0)) > 0.5
+    ):
+        return None
+
+    im = PdfImage(images[0]).as_pil_image()
+    if im.mode != _MODES[device]:
+        return None
+    # Ghostscript draws the page with its /Rotate applied
+    rotate = int(page.obj.get(Name.Rotate, 0)) % 360
+    if rotate == 90:
+        im = im.transpose(Image.Transpose.ROTATE_270)
+    elif rotate == 180:
+        im = im.transpose(Image.Transpose.ROTATE_180)
+    elif rotate == 270:
+        im = im.transpose(Image.Transpose.ROTATE_90)
+    return im
+
+
+def image_name(pageno, device, dpi, filter_vector=False):
+    """
+    File name of a batch-rendered page (1-based), which says how it was
+    rendered
+    """
+    dpi = dpi.round(6)
+    suffix = "_novector" if filter_vector else ""
+    return f"{pageno:06d}_{device}_{dpi.x:f}x{dpi.y:f}{suffix}.png"
+
+
+class _Run:
+    def __init__(self, index, device, dpi, native, vector_free):
+        self.index = index
+        self.device = device
+        self.dpi = dpi
+        # Pages whose image is used as is (see _native_image)
+        self.native = native
+        # Pages that also need an image without their vector graphics
+        self.vector_free = vector_free
+        self.pagenos = []
+
+    @property
+    def key(self):
+        return self.device, self.dpi, self.native, self.vector_free
+
+
+class BatchRasterizer:
+    """
+    Renders the pages of page_contexts in runs of up to
+    PDFOCR_RASTER_BATCH_PAGES pages, never more than the page window plus
+    one run ahead of the pages the workers have finished
+    """
+
+    def __init__(self, context, page_contexts, max_workers):
+        self.directory = context.work_folder / RASTER_DIR
+        self.origin = context.origin
+        self.stop_on_error = not context.options.continue_on_soft_render_error
+        self.remove_vectors = context.options.remove_vectors
+        self.batch_pages = max(1, config.RASTER_BATCH_PAGES)
+        self.ahead = page_window(max_workers) + self.batch_pages
+        # One ghostscript for every four page workers keeps ahead of OCR
+        self.threads = max(1, max_workers // 4)
+        self.batches = 0
+        self.pages = 0
+        self.vector_free_pages = 0
+        self.native_pages = 0
+        self._runs = []
+        self._plan(page_contexts)
+        self.enabled = bool(self._runs)
+        self._next_run = 0
+        self._rendered = 0
+        self._done = 0
+        self._stop = False
+        self._changed = threading.Condition()
+        self._workers = []
+
+    def _plan(self, page_contexts):
+        runs = []
+        plan = {}
+        for page_context in page_contexts:
+            pageno = page_context.pageno + 1
+            device = raster_device(page_context.pageinfo)
+            dpi = get_canvas_square_dpi(page_context, calculate_image_dpi(page_context))
+            native = _native_size(page_context, device, dpi)
+            vector_free = self.remove_vectors and page_context.pageinfo.has_vector
+            if self.batch_pages == 1 and not native:
+                # Without batching, there is nothing to gain from rendering
+                # the page here rather than in its worker
+                continue
+            key = device, dpi, native, vector_free
+            last = runs[-1] if runs else None
+            if (
+                last is None
+                or last.key != key
+                or last.pagenos[-1] != pageno - 1
+                or len(last.pagenos) == self.batch_pages
+            ):
+                last = _Run(len(runs), *key)
+                runs.append(last)
+            last.pagenos.append(pageno)
+            plan[pageno] = {"image": image_name(pageno, device, dpi), "dpi": dpi.x}
+            if self.remove_vectors:
+                # The image for OCR, the same one if there are no vectors
+                plan[pageno]["ocr_image"] = image_name(pageno, device, dpi, vector_free)
+
+        # Written even if empty, so that the hook has somewhere to record
+        # the pages it leaves to ghostscript
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.directory / PLAN_FILE, "w") as f:
+            json.dump(plan, f)
+        self._runs = runs
+
+    def __enter__(self):
+        if self.enabled:
+            for _ in range(self.threads):
+                worker = threading.Thread(target=self._work, name="rasterizer")
+                worker.start()
+                self._workers.append(worker)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._changed:
+            self._stop = True
+            self._changed.notify_all()
+        for worker in self._workers:
+            worker.join()
+        if self._next_run < len(self._runs):
+            (self.directory / STOPPED_FILE).touch()
+        return False
+
+    def page_done(self):
+        """
+        A page worker finished a page, so the rasterizer can go further
+        """
+        with self._changed:
+            self._done += 1
+            self._changed.notify_all()
+
+    def _work(self):
+        while True:
+            with self._changed:
+                # Runs start in order: a later run taking the room an earlier
+                # one needs could leave a worker waiting for its page forever
+                self._changed.wait_for(
+                    lambda: self._stop
+                    or self._next_run >= len(self._runs)
+                    or self._rendered
+                    + len(self._runs[self._next_run].pagenos)
+                    - self._done
+                    <= self.ahead
+                )
+                if self._stop or self._next_run >= len(self._runs):
+                    return
+                batch = self._runs[self._next_run]
+                self._next_run += 1
+                self._rendered += len(batch.pagenos)
+                self._changed.notify_all()
+            try:
+                self._render(batch)
+            except Exception:
+                # The workers waiting for these pages rasterize them
+                # themselves instead
+                logger.exception(
+                    f"Rasterizing pages {batch.pagenos[0]}-{batch.pagenos[-1]} failed"
+                )
+                self._failed(batch)
+
+    def _render(self, batch):
+        if batch.native and self._extract(batch):
+            with self._changed:
+                self.native_pages += len(batch.pagenos)
+            return
+        self._ghostscript(batch)
+        if batch.vector_free:
+            self._ghostscript(batch, filter_vector=True)
+
+    def _failed(self, batch, filter_vector=None):
+        """
+        Tell the workers that the images of the batch's pages (the ones with
+        vector graphics, the ones without, or both if filter_vector is None)
+        will not come
+        """
+        kinds = [False, True] if filter_vector is None else [filter_vector]
+        for pageno in batch.pagenos:
+            for kind in kinds:
+                if kind and not batch.vector_free:
+                    continue
+                name = image_name(pageno, batch.device, batch.dpi, kind)
+                if not (self.directory / name).exists():
+                    (self.directory / f"{name}.failed").touch()
+
+    def _ghostscript(self, batch, filter_vector=False):
+        first, last = batch.pagenos[0], batch.pagenos[-1]
+        pattern = self.directory / f"batch{first:06d}-%d.tmp"
+        args = (
+            [
+                GS,
+                "-dQUIET",
+                "-dSAFER",
+                "-dBATCH",
+                "-dNOPAUSE",
+                "-dInterpolateControl=-1",
+                f"-sDEVICE={batch.device}",
+                f"-dFirstPage={first}",
+                f"-dLastPage={last}",
+                f"-r{batch.dpi.x:f}x{batch.dpi.y:f}",
+            ]
+            + (["-dFILTERVECTOR"] if filter_vector else [])
+            + (["-dPDFSTOPONERROR"] if self.stop_on_error else [])
+            + [
+                "-o",
+                os.fspath(pattern),
+                "-dAutoRotatePages=/None",
+                "-f",
+                os.fspath(self.origin),
+            ]
+        )
+        try:
+            p = run(args, stdout=PIPE, stderr=PIPE, check=True)
+            stderr = p.stderr.decode(errors="replace")
+            if _gs_error_reported(stderr):
+                logger.error(stderr)
+            for n, pageno in enumerate(batch.pagenos, 1):
+                name = image_name(pageno, batch.device, batch.dpi, filter_vector)
+                os.replace(
+                    self.directory / f"batch{first:06d}-{n}.tmp",
+                    self.directory / name,
+                )
+        except (CalledProcessError, OSError) as e:
+            # The workers rasterize these pages themselves, and report the
+            # error if there is one
+            logger.warning(f"Rasterizing pages {first}-{last} in one batch failed: {e}")
+            self._failed(batch, filter_vector)
+            return
+        with self._changed:
+            self.batches += 1
+            if filter_vector:
+                self.vector_free_pages += len(batch.pagenos)
+            else:
+                self.pages += len(batch.pagenos)
+
+    def _extract(self, batch):
+        """
+        Save the images of the batch's pages as their rendered images, or
+        return False if any cannot be used as is
+        """
+        try:
+            with open_pdf(self.origin) as pdf:
+                for pageno in batch.pagenos:
+                    im = _native_image(pdf.pages[pageno - 1], batch.device)
+                    if im is None:
+                        return False
+                    name = image_name(pageno, batch.device, batch.dpi)
+                    im.save(self.directory / f"{name}.tmp", format="PNG", dpi=batch.dpi)
+                    os.replace(self.directory / f"{name}.tmp", self.directory / name)
+        except Exception as e:
+            # Images pikepdf cannot decode (JBIG2 without jbig2dec, ...) are
+            # left to ghostscript
+            logger.debug(f"Using the images of pages {batch.pagenos} failed: {e}")
+            return False
+        return True
+
+    def stats(self, pages):
+        """
+        How the page images of pages pages were produced
+        """
+        renders = Counter()
+        with suppress(FileNotFoundError):
+            with open(self.directory / RENDERS_FILE) as f:
+                renders.update(line.strip() for line in f)
+        # Ghostscript renders of a single page, a page of a batch counting as
+        # one; native images, derived previews and shared vector-free images
+        # are not renders
+        page_renders = (
+            self.pages + self.vector_free_pages + renders["page"] + renders["preview"]
+        )
+        return {
+            "raster_batches": self.batches,
+            "pages_batch_rasterized": self.pages,
+            "vector_free_batch_rasterized": self.vector_free_pages,
+            "pages_native_raster": self.native_pages,
+            "previews_from_page_image": renders["derived"],
+            "vector_free_images_shared": renders["shared"],
+            "page_renders": page_renders,
+            "renders_per_page": round(page_renders / pages, 2) if pages else 0.0,
+        }
+
+
+# The plan of the job a page worker last rasterized for
+_plan = (None, {})
+
+
+def _load_plan(directory):
+    global _plan
+    if _plan[0] != directory:
+        try:
+            with open(directory / PLAN_FILE) as f:
+                _plan = (directory, json.load(f))
+        except FileNotFoundError:
+            _plan = (directory, {})
+    return _plan[1]
+
+
+def _record(directory, kind):
+    with suppress(FileNotFoundError):
+        # Appending a line is atomic, whichever worker does it
+        with open(directory / RENDERS_FILE, "a") as f:
+            f.write(f"{kind}\n")
+
+
+def _save_preview(image_path, output_file, scale, page_dpi):
+    """
+    The orientation preview ghostscript would render, scaled down from the
+    page's image
+    """
+    with Image.open(image_path) as im:
+        size = (max(1, round(im.width * scale)), max(1, round(im.height * scale)))
+        preview = im.convert("L").resize(size, Image.Resampling.BOX)
+    preview.save(os.fspath(output_file), format="JPEG", dpi=page_dpi)
+
+
+def _wait_for_image(directory, name):
+    """
+    The path of the batch image name once it is there, or None if its batch
+    failed, the rasterizer stopped or PDFOCR_RASTER_WAIT_SECONDS went by
+    """
+    path = directory / name
+    deadline = time.monotonic() + config.RASTER_WAIT_SECONDS
+    while not path.exists():
+        if (directory / f"{name}.failed").exists():
+            return None
+        if (directory / STOPPED_FILE).exists():
+            return path if path.exists() else None
+        if time.monotonic() > deadline:
+            logger.warning(f"Gave up waiting for {name}")
+            return None
+        time.sleep(POLL_SECONDS)
+    return path
+
+
+@hookimpl
+def rasterize_pdf_page(
+    input_file,
+    output_file,
+    raster_device,
+    raster_dpi,
+    pageno,
+    page_dpi,
+    rotation,
+    filter_vector,
+    stop_on_soft_error,
+):
+    """
+    Use the page's image from its batch if it was rendered with the same
+    settings, or scale the orientation preview down from it; returning None
+    leaves the page to ocrmypdf's ghostscript
+    """
+    directory = Path(output_file).parent / RASTER_DIR
+    preview = raster_device == PREVIEW_DEVICE and not rotation
+    planned = _load_plan(directory).get(str(pageno))
+    name = None
+    if planned is not None:
+        if preview:
+            name = planned["image"]
+        elif planned["image"] == image_name(pageno, raster_device, raster_dpi):
+            name = planned.get("ocr_image") if filter_vector else planned["image"]
+    image_path = _wait_for_image(directory, name) if name else None
+    if image_path is None:
+        _record(directory, "preview" if preview else "page")
+        return None
+
+    if preview:
+        # The page's image is still needed for the page itself
+        scale = raster_dpi.x / planned["dpi"]
+        _save_preview(image_path, output_file, scale, page_dpi or raster_dpi)
+        _record(directory, "derived")
+        return output_file
+
+    # Same as ocrmypdf._exec.ghostscript.rasterize_pdf does with the image
+    # ghostscript produced
+    page_dpi = page_dpi or raster_dpi
+    with Image.open(image_path) as im:
+        if rotation is not None:
+            # rotation is a clockwise angle and Image.ROTATE_* is
+            # counterclockwise so this cancels out the rotation
+            if rotation == 90:
+                im = im.transpose(Image.Transpose.ROTATE_90)
+            elif rotation == 180:
+                im = im.transpose(Image.Transpose.ROTATE_180)
+            elif rotation == 270:
+                im = im.transpose(Image.Transpose.ROTATE_270)
+            if rotation % 180 == 90:
+                page_dpi = page_dpi.flip_axis()
+        im.save(os.fspath(output_file), dpi=page_dpi)
+    if filter_vector and name == planned["image"]:
+        _record(directory, "shared")
+    # A shared image is used for OCR after it is used for the page itself
+    if filter_vector or planned.get("ocr_image") != name:
+        image_path.unlink()
+    return output_file
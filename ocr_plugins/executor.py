@@ -0,0 +1,235 @@
+"""
+Page task executor with a bounded submission window.
+
+ocrmypdf's StandardExecutor submits a task for every page before the first
+one finishes, so each page's context is pickled and queued at once and the
+rasters of pages that are done but not yet grafted pile up in the work
+folder. WindowedExecutor keeps at most PDFOCR_PAGE_WINDOW pages in flight
+(submitted and not yet handed to the pipeline) and submits the next page
+only when one is taken, which also makes the workers wait when grafting
+falls behind. Memory and temporary space then depend on the window, not on
+the page count.
+
+With worker processes (use_threads=False), ocrmypdf starts a new pool for
+every call, forked from a process that already runs threads, and each
+worker imports what its tasks need again. WindowedExecutor keeps one pool
+per process instead, started from a forkserver that has preloaded those
+modules (see worker_preload), and reuses it for the calls and jobs that
+follow. The initializer of each call still runs in every worker, the first
+time the worker gets one of the call's tasks.
+
+Adapted from ocrmypdf.builtin_plugins.concurrency (MPL-2.0).
+"""
+import itertools
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from contextlib import nullcontext
+from multiprocessing.util import Finalize
+
+from ocrmypdf import hookimpl
+from ocrmypdf.builtin_plugins.concurrency import (
+    StandardExecutor,
+    log_listener,
+    process_init,
+    thread_init,
+)
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PRELOAD_MODULE = "worker_preload"
+
+# The process pool of this process, kept between calls: the pool, its
+# workers, the log level they were started with, and the queue their log
+# records come back through
+_pool = None
+_pool_workers = 0
+_pool_loglevel = None
+_log_queue = None
+# Tells the workers which call a task belongs to
+_calls = itertools.count()
+
+# In a pool worker: the call whose initializer it ran last
+_initialized = None
+
+
+def page_window(max_workers):
+    """
+    Pages in flight at once: the configured window, or two per page worker
+    so a worker always has its next page ready
+    """
+    return max(1, config.PAGE_WINDOW or 2 * max_workers)
+
+
+def _no_init():
+    pass
+
+
+def _context():
+    from ocr_worker import get_context
+
+    context = get_context()
+    if context.get_start_method() == "forkserver":
+        context.set_forkserver_preload([PRELOAD_MODULE])
+    return context
+
+
+def _process_pool(max_workers):
+    """
+    This process's pool, with max_workers processes at least; it replaces
+    the pool it has if that is smaller
+    """
+    global _pool, _pool_workers, _pool_loglevel, _log_queue
+    loglevel = logging.getLogger("").level
+    if _pool is not None and (
+        _pool_workers < max_workers or _pool_loglevel != loglevel
+    ):
+        _pool.shutdown()
+        _pool = None
+    if _pool is None:
+        context = _context()
+        if _log_queue is None:
+            _log_queue = context.Queue(-1)
+            threading.Thread(
+                target=log_listener,
+                args=(_log_queue,),
+                name="pool-log-listener",
+                daemon=True,
+            ).start()
+            # A process started by multiprocessing, such as a job worker,
+            # waits for its children when it exits before the pool is told
+            # to stop them; stop it first, while its queues still work
+            Finalize(None, _shutdown_pool, exitpriority=100)
+        _pool = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=context,
+            initializer=process_init,
+            initargs=(_log_queue, _no_init, loglevel),
+        )
+        _pool_workers, _pool_loglevel = max_workers, loglevel
+        logger.debug(f"Started a pool of {max_workers} worker processes")
+    return _pool
+
+
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+
+
+def _forget_pool(pool):
+    """
+    Start a new process pool for the next call if pool is this process's
+    """
+    global _pool
+    if pool is _pool:
+        _pool = None
+
+
+def _run(call, worker_initializer, task, *args):
+    """
+    task(*args) in a pool worker, after worker_initializer if the worker has
+    not run it for call yet
+    """
+    global _initialized
+    if _initialized != call:
+        # ocrmypdf's triage initializer opens the input for the worker and
+        # only closes it when the worker exits; the call it was for is over
+        from ocrmypdf.pdfinfo import info
+
+        if getattr(info, "worker_pdf", None) is not None:
+            info.worker_pdf.close()
+            info.worker_pdf = None
+        worker_initializer()
+        _initialized = call
+    return task(*args)
+
+
+class WindowedExecutor(StandardExecutor):
+    """
+    StandardExecutor that submits tasks through a sliding window, to a pool
+    of worker processes kept between calls or to threads
+    """
+
+    def _execute(
+        self,
+        *,
+        use_threads,
+        max_workers,
+        progress_kwargs,
+        worker_initializer,
+        task,
+        task_arguments,
+        task_finished,
+    ):
+        window = page_window(max_workers)
+        if use_threads:
+            log_queue = queue.Queue(-1)
+            listener = threading.Thread(target=log_listener, args=(log_queue,))
+            listener.start()
+            pool = ThreadPoolExecutor(
+                max_workers=max_workers,
+                initializer=thread_init,
+                initargs=(log_queue, worker_initializer, logging.getLogger("").level),
+            )
+
+            def submit(executor, args):
+                return executor.submit(task, *args)
+
+        else:
+            log_queue = listener = None
+            shared = _process_pool(max_workers)
+            # The pool may have more workers than this call is allowed; only
+            # as many tasks as it may run are then in flight
+            if _pool_workers > max_workers:
+                window = max_workers
+            pool = nullcontext(shared)
+            call = next(_calls)
+
+            def submit(executor, args):
+                return executor.submit(_run, call, worker_initializer, task, *args)
+
+        logger.debug(f"Submitting pages with a window of {window}")
+        arguments = iter(task_arguments)
+        with self.pbar_class(**progress_kwargs) as pbar, pool as executor:
+            in_flight = {
+                submit(executor, args) for args in itertools.islice(arguments, window)
+            }
+            try:
+                while in_flight:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        task_finished(future.result(), pbar)
+                        for args in itertools.islice(arguments, 1):
+                            in_flight.add(submit(executor, args))
+            except KeyboardInterrupt:
+                # Terminate pool so we exit instantly
+                executor.shutdown(wait=False, cancel_futures=True)
+                _forget_pool(executor)
+                raise
+            except Exception:
+                if not os.environ.get("PYTEST_CURRENT_TEST", ""):
+                    executor.shutdown(wait=False, cancel_futures=True)
+                # Its workers may still run tasks of this call, or be gone
+                _forget_pool(executor)
+                raise
+            finally:
+                # Terminate log listener
+                if log_queue is not None:
+                    log_queue.put_nowait(None)
+
+        if listener is not None:
+            listener.join()
+
+
+@hookimpl
+def get_executor(progressbar_class):
+    return WindowedExecutor(pbar_class=progressbar_class)
@@ -0,0 +1,154 @@
+"""
+Job progress reporting.
+
+ocrmypdf reports the work it does through progress bar objects created from
+the get_progressbar_class hook. The progress bar defined here turns those
+updates into progress events for the job the worker is running: pages
+scanned during triage, pages OCR'd, and how far the post-processing steps
+got. The pipeline announces the phases itself (see ocr_pipeline), which also
+gives the time spent in each of them.
+"""
+import threading
+import time
+
+from ocrmypdf import hookimpl
+
+# Progress bars that count pages of the document, by description
+_PAGE_COUNTERS = {
+    "Scanning contents": "pages_scanned",
+    "OCR": "pages_ocr",
+    "Image processing": "pages_ocr",
+}
+
+_current = None
+
+
+class JobProgress:
+    """
+    Progress of the job a worker is running; every change is passed to send.
+    Updates may come from the pipeline's assembly thread as well.
+    """
+
+    def __init__(self, send):
+        self._send = send
+        self._lock = threading.Lock()
+        self._phase_started = None
+        self.phases = {}
+        self.state = {
+            "phase": None,
+            "pages": None,
+            "pages_scanned": 0,
+            "pages_ocr": 0,
+            "pages_from_cache": 0,
+            "step": None,
+        }
+
+    def set_phase(self, name):
+        with self._lock:
+            self._end_phase()
+            self._phase_started = time.perf_counter()
+            self.state["phase"] = name
+            self.state["step"] = None
+            self._send(dict(self.state))
+
+    def update(self, **values):
+        with self._lock:
+            if all(self.state.get(key) == value for key, value in values.items()):
+                return
+            self.state.update(values)
+            self._send(dict(self.state))
+
+    def _end_phase(self):
+        phase = self.state["phase"]
+        if phase is not None:
+            elapsed = time.perf_counter() - self._phase_started
+            self.phases[phase] = self.phases.get(phase, 0) + elapsed
+
+    def finish(self):
+        """
+        Close the last phase and return the seconds spent in each phase
+        """
+        with self._lock:
+            self._end_phase()
+            self.state["phase"] = None
+            return self.phases
+
+
+def start(send):
+    """
+    Report the progress of a new job through send
+    """
+    global _current
+    _current = JobProgress(send)
+    return _current
+
+
+def stop():
+    """
+    Stop reporting; returns the seconds spent in each phase of the job
+    """
+    global _current
+    progress, _current = _current, None
+    return progress.finish() if progress else {}
+
+
+def set_phase(name):
+    if _current is not None:
+        _current.set_phase(name)
+
+
+def update(**values):
+    if _current is not None:
+        _current.update(**values)
+
+
+class EventProgressBar:
+    """
+    ocrmypdf progress bar that reports to the current job instead of a
+    terminal. Updates are forwarded whenever a whole unit is completed.
+    """
+
+    def __init__(self, *, total=None, desc=None, unit=None, disable=False, **kwargs):
+        self.total = total
+        self.desc = desc
+        self.unit = unit
+        self.count = 0
+        self._reported = None
+
+    def __enter__(self):
+        self._report()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._report()
+        return False
+
+    def update(self, n=1, *, completed=None):
+        if completed is not None:
+            self.count = completed
+        else:
+            self.count += n
+        if int(self.count) != self._reported:
+            self._report()
+
+    def _report(self):
+        if _current is None:
+            return
+        self._reported = int(self.count)
+        counter = _PAGE_COUNTERS.get(self.desc)
+        if counter:
+            _current.update(**{counter: self._reported})
+        else:
+            _current.update(
+                step={
+                    "desc": self.desc,
+                    "done": self._reported,
+                    "total": self.total,
+                    "unit": self.unit,
+                }
+            )
+
+
+@hookimpl
+def get_progressbar_class():
+    return EventProgressBar
@@ -0,0 +1,360 @@
+"""
+OCR with tesseract kept loaded in the page workers.
+
+ocrmypdf runs the tesseract program for every page, and each run loads the
+language models (tens of MB for eng+spa) and sets up the recognizer before
+it looks at the page. With tesserocr installed (pip install -e .[resident]),
+ResidentTesseractEngine keeps tesseract APIs loaded in every page worker
+process, for the job's languages and engine mode, and lends one to each
+page the process works on, writing the same files the tesseract program
+would. The APIs belong to the process, not to the threads that use them,
+so they outlast the executor's thread pools and serve every job with the
+same settings. Without tesserocr, with PDFOCR_RESIDENT_TESSERACT=0, or with
+options the API is not set up for here (config files, user words or
+patterns), ocrmypdf runs the tesseract program as usual.
+
+Before OCR, ocrmypdf asks the engine for a page's orientation (rotate_pages)
+and its skew (deskew), each a tesseract run of its own, and for the skew
+again whenever it preprocesses a second image of the page. Both engines
+here keep the answers on the page's PageContext (see analysing) as a
+PageAnalysis, so nothing is worked out twice; the resident engine finds
+orientation, script and skew in one pass over the image. The skew of a page
+does not change when it is turned by a multiple of 90 degrees, so the one
+found on the orientation preview holds for the upright page as well.
+"""
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager, suppress
+from math import degrees
+from os import fspath
+
+from ocrmypdf import hookimpl
+from ocrmypdf._exec.tesseract import _generate_null_hocr, page_timedout, use_skip_page
+from ocrmypdf.builtin_plugins.tesseract_ocr import TesseractOcrEngine
+from ocrmypdf.pluginspec import OrientationConfidence
+
+import config
+
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+# The page each page worker thread is working on
+_local = threading.local()
+
+# This process's APIs not in use, by languages, engine mode and
+# thresholding; a thread takes one for itself while it uses it, as
+# tesseract's API is not thread-safe
+_idle = {}
+_idle_lock = threading.Lock()
+
+# What tesseract found out about a page before OCR; None for what it was not
+# asked yet
+PageAnalysis = namedtuple(
+    "PageAnalysis", ["orientation", "script", "script_confidence", "deskew"]
+)
+_NOT_ANALYSED = PageAnalysis(None, None, None, None)
+
+
+@contextmanager
+def analysing(page_context):
+    """
+    Have the engine keep what it finds out about the page of page_context,
+    which the calling thread processes within the with block
+    """
+    _local.page_context = page_context
+    try:
+        yield
+    finally:
+        _local.page_context = None
+
+
+def _cached(field, find):
+    """
+    The field of the current page's analysis, from find() if not known yet.
+    find returns a PageAnalysis with the fields it found out.
+    """
+    page_context = getattr(_local, "page_context", None)
+    analysis = getattr(page_context, "analysis", _NOT_ANALYSED)
+    if getattr(analysis, field) is None:
+        found = find()
+        analysis = analysis._replace(
+            **{
+                name: value
+                for name, value in found._asdict().items()
+                if value is not None
+            }
+        )
+        if page_context is not None:
+            page_context.analysis = analysis
+    return getattr(analysis, field)
+
+
+def _key(options):
+    return (
+        "+".join(options.languages),
+        options.tesseract_oem,
+        options.tesseract_thresholding,
+    )
+
+
+def _take(key):
+    """
+    An idle API of this process loaded for key, or a new one
+    """
+    with _idle_lock:
+        apis = _idle.get(key)
+        if apis:
+            return apis.pop()
+        # A process serves one job at a time: the models of another job's
+        # settings are not needed any more
+        stale = [
+            api for other in list(_idle) if other != key for api in _idle.pop(other)
+        ]
+    for api in stale:
+        api.End()
+    start = time.perf_counter()
+    oem = tesserocr.OEM.DEFAULT if key[1] is None else key[1]
+    api = tesserocr.PyTessBaseAPI(lang=key[0], oem=oem)
+    if key[2]:
+        api.SetVariable("thresholding_method", str(key[2]))
+    logger.debug(f"Loaded tesseract for {key[0]} in {time.perf_counter() - start:.2f}s")
+    return api
+
+
+def _give_back(key, api):
+    with _idle_lock:
+        _idle.setdefault(key, []).append(api)
+
+
+@contextmanager
+def _api(options):
+    """
+    An API of this process loaded for options' languages, engine mode and
+    thresholding, for the calling thread's use within the with block
+    """
+    key = _key(options)
+    api = _take(key)
+    try:
+        yield api
+    except BaseException:
+        # It may be left in any state
+        api.End()
+        raise
+    _give_back(key, api)
+
+
+def _usable(options):
+    return (
+        not options.tesseract_config
+        and not options.user_words
+        and not options.user_patterns
+        # A timeout of 0 means no OCR at all, which ocrmypdf handles
+        and options.tesseract_timeout != 0
+    )
+
+
+def _process(input_file, prefix, options, renderers):
+    """
+    OCR input_file into prefix.hocr, prefix.pdf and prefix.txt, as
+    `tesseract input_file prefix <renderers> txt` does. Returns False if
+    tesseract failed and raises TimeoutError if it ran out of time.
+    """
+    with _api(options) as api:
+        for renderer in ("hocr", "pdf"):
+            api.SetVariable(
+                f"tessedit_create_{renderer}", "1" if renderer in renderers else "0"
+            )
+        api.SetVariable("tessedit_create_txt", "1")
+        api.SetVariable("textonly_pdf", "1")
+        psm = options.tesseract_pagesegmode
+        api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+        start = time.perf_counter()
+        timeout_ms = int(options.tesseract_timeout * 1000)
+        if api.ProcessPages(fspath(prefix), fspath(input_file), None, timeout_ms):
+            return True
+    # ProcessPages does not say why it failed
+    if time.perf_counter() - start >= options.tesseract_timeout:
+        raise TimeoutError()
+    return False
+
+
+def _find(api, input_file, orientation, skew):
+    api.SetPageSegMode(
+        tesserocr.PSM.AUTO_OSD if orientation else tesserocr.PSM.AUTO_ONLY
+    )
+    api.SetImageFile(fspath(input_file))
+    found = _NOT_ANALYSED
+    if orientation:
+        # None when there is too little text to tell, as the program's
+        # "Too few characters" error
+        osd = api.DetectOrientationScript() or {}
+        found = found._replace(
+            orientation=OrientationConfidence(
+                angle=int(osd.get("orient_deg", 0)),
+                confidence=float(osd.get("orient_conf", 0.0)),
+            ),
+            script=osd.get("script_name", ""),
+            script_confidence=float(osd.get("script_conf", 0.0)),
+        )
+    if skew:
+        layout = api.AnalyseLayout()
+        # Radians counterclockwise with the text upright, as
+        # `tesseract --psm 2` prints it
+        deskew = degrees(layout.Orientation()[3]) if layout is not None else 0.0
+        found = found._replace(deskew=deskew)
+    api.Clear()
+    return found
+
+
+def _analyse(input_file, options, orientation, skew):
+    """
+    Orientation and script, skew, or all of them for input_file, in one pass
+    of a resident API, within tesseract_non_ocr_timeout
+    """
+    # What the tesseract program answers when it runs out of time
+    timed_out = _NOT_ANALYSED
+    if orientation:
+        timed_out = timed_out._replace(
+            orientation=OrientationConfidence(angle=0, confidence=0.0),
+            script="",
+            script_confidence=0.0,
+        )
+    if skew:
+        timed_out = timed_out._replace(deskew=0.0)
+    timeout = options.tesseract_non_ocr_timeout
+    if timeout == 0:
+        return timed_out
+
+    # The API cannot be stopped, so it runs on a thread of its own that
+    # gives it back when it is done, whether or not the page still waits
+    key = _key(options)
+    api = _take(key)
+    future = Future()
+
+    def find():
+        try:
+            future.set_result(_find(api, input_file, orientation, skew))
+        except Exception as e:
+            api.End()
+            future.set_exception(e)
+        else:
+            _give_back(key, api)
+
+    threading.Thread(target=find, name="tesseract-analysis", daemon=True).start()
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        logger.warning("[tesseract] page analysis took too long - skipping")
+        return timed_out
+
+
+class TesseractEngine(TesseractOcrEngine):
+    """
+    TesseractOcrEngine that works out each page's orientation and skew only
+    once
+    """
+
+    @staticmethod
+    def get_orientation(input_file, options):
+        return _cached(
+            "orientation",
+            lambda: _NOT_ANALYSED._replace(
+                orientation=TesseractOcrEngine.get_orientation(input_file, options)
+            ),
+        )
+
+    @staticmethod
+    def get_deskew(input_file, options):
+        return _cached(
+            "deskew",
+            lambda: _NOT_ANALYSED._replace(
+                deskew=TesseractOcrEngine.get_deskew(input_file, options)
+            ),
+        )
+
+
+class ResidentTesseractEngine(TesseractEngine):
+    """
+    TesseractEngine that OCRs pages with a resident API of the worker. A
+    page that runs out of time is skipped, as the tesseract program's would
+    be; if the API fails otherwise, the page goes to the program, which
+    fails the way ocrmypdf expects and reports it
+    """
+
+    @staticmethod
+    def version():
+        # The library tesserocr is built against, which may not be the
+        # program's
+        return tesserocr.tesseract_version().split()[1]
+
+    def __str__(self):
+        return f"Tesseract OCR {self.version()} (resident)"
+
+    @staticmethod
+    def get_orientation(input_file, options):
+        # The skew is wanted too with deskew, for the same page turned upright
+        return _cached(
+            "orientation",
+            lambda: _analyse(
+                input_file, options, orientation=True, skew=options.deskew
+            ),
+        )
+
+    @staticmethod
+    def get_deskew(input_file, options):
+        return _cached(
+            "deskew",
+            lambda: _analyse(input_file, options, orientation=False, skew=True),
+        )
+
+    @staticmethod
+    def generate_hocr(input_file, output_hocr, output_text, options):
+        if not _usable(options):
+            return TesseractOcrEngine.generate_hocr(
+                input_file, output_hocr, output_text, options
+            )
+        prefix = output_hocr.with_suffix("")
+        try:
+            processed = _process(input_file, prefix, options, ["hocr"])
+        except TimeoutError:
+            page_timedout(options.tesseract_timeout)
+            return _generate_null_hocr(output_hocr, output_text, input_file)
+        if not processed:
+            return TesseractOcrEngine.generate_hocr(
+                input_file, output_hocr, output_text, options
+            )
+        with suppress(FileNotFoundError):
+            prefix.with_suffix(".txt").replace(output_text)
+
+    @staticmethod
+    def generate_pdf(input_file, output_pdf, output_text, options):
+        if not _usable(options):
+            return TesseractOcrEngine.generate_pdf(
+                input_file, output_pdf, output_text, options
+            )
+        prefix = output_pdf.parent / output_pdf.stem
+        try:
+            processed = _process(input_file, prefix, options, ["pdf"])
+        except TimeoutError:
+            page_timedout(options.tesseract_timeout)
+            return use_skip_page(output_pdf, output_text)
+        if not processed:
+            return TesseractOcrEngine.generate_pdf(
+                input_file, output_pdf, output_text, options
+            )
+        with suppress(FileNotFoundError):
+            prefix.with_suffix(".txt").replace(output_text)
+
+
+@hookimpl
+def get_ocr_engine():
+    if tesserocr is not None and config.RESIDENT_TESSERACT:
+        return ResidentTesseractEngine()
+    return TesseractEngine()
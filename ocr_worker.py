@@ -0,0 +1,213 @@
+"""
+OCR worker processes.
+
+Each worker imports ocrmypdf and its dependencies, discovers the plugins and
+probes tesseract and ghostscript once, when the process starts. After that
+it serves job after job through ocrmypdf's API, so a short document only
+pays for its own pages instead of a full interpreter start-up.
+"""
+import functools
+import logging
+import multiprocessing
+import time
+from importlib.metadata import version
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Options passed to ocrmypdf for every job
+OCR_OPTIONS = {
+    "language": config.OCR_LANGUAGE.split("+"),
+    "force_ocr": True,  # Forzar OCR incluso si ya tiene texto
+    "optimize": config.OCR_OPTIMIZE,
+    "output_type": config.OCR_OUTPUT_TYPE,
+    # Progress goes to the job's events (see ocr_plugins.progress), not a
+    # terminal
+    "progress_bar": True,
+    # Pages go to worker processes instead of threads (see
+    # ocr_plugins.executor). Options become command line flags, and
+    # use_threads=False would only leave out --use-threads, which is the
+    # default
+    "no_use_threads": config.PAGE_PROCESSES,
+}
+
+# Options that do not change the result
+_RUN_OPTIONS = {"progress_bar", "no_use_threads"}
+
+_plugin_manager = None
+_page_cache = None
+_warmup_seconds = None
+_events = None
+
+
+def get_context():
+    """
+    Multiprocessing context for the worker pool.
+
+    The web server already runs threads when the pool starts, so avoid plain
+    fork and start workers from a clean interpreter instead.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in methods else "spawn"
+    )
+
+
+def effective_options():
+    """
+    Everything that decides the output for a given input, used to key the
+    result cache
+    """
+    options = {k: v for k, v in OCR_OPTIONS.items() if k not in _RUN_OPTIONS}
+    options["ocrmypdf"] = version("ocrmypdf")
+    return options
+
+
+def _cache_version_probes():
+    """
+    Remember the answers of the external program probes.
+
+    ocrmypdf asks tesseract, ghostscript and friends for their version (and
+    tesseract for its languages) on every run. The installed programs do not
+    change while a worker is alive, so ask only once.
+    """
+    from ocrmypdf._exec import ghostscript, jbig2enc, pngquant, tesseract, unpaper
+
+    for module, name in [
+        (ghostscript, "version"),
+        (jbig2enc, "version"),
+        (pngquant, "version"),
+        (tesseract, "version"),
+        (tesseract, "get_languages"),
+        (unpaper, "version"),
+    ]:
+        func = getattr(module, name)
+        if not hasattr(func, "cache_info"):
+            setattr(module, name, functools.lru_cache(maxsize=None)(func))
+
+    tesseract.version()
+    tesseract.get_languages()
+    ghostscript.version()
+
+
+def init_worker(events=None):
+    """
+    Pool initializer: pay the fixed start-up cost once per process.
+
+    Progress of the jobs is sent to the events queue as (job_id, progress)
+    tuples.
+    """
+    global _plugin_manager, _page_cache, _warmup_seconds, _events
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    start = time.perf_counter()
+
+    from ocrmypdf._plugin_manager import get_plugin_manager
+
+    from ocr_plugins import PLUGINS
+    from page_cache import PageCache
+
+    _events = events
+    _plugin_manager = get_plugin_manager(PLUGINS)
+    _page_cache = PageCache(config.PAGE_CACHE_DIR, config.PAGE_CACHE_MAX_BYTES)
+    try:
+        _cache_version_probes()
+    except Exception as e:
+        # Missing programs are reported again, per job, by ocrmypdf itself
+        logger.error(f"Could not probe OCR dependencies: {e}")
+
+    _warmup_seconds = time.perf_counter() - start
+    logger.info(f"OCR worker ready in {_warmup_seconds:.2f}s")
+
+
+def ping():
+    """
+    No-op task used to start the workers ahead of the first job
+    """
+    return _warmup_seconds
+
+
+def _ocr(input_path, output_path, streamer=None, work=None, **kwargs):
+    """
+    Equivalent of ocrmypdf.api.ocr using this worker's plugin manager and
+    the service's own pipeline (see ocr_pipeline).
+
+    ocrmypdf.ocr(plugin_manager=...) turns the plugin manager into a command
+    line argument and fails, so follow the same steps here. Returns the exit
+    code and the pipeline stats, including the time spent building and
+    checking the options.
+    """
+    from ocrmypdf import api
+    from ocrmypdf._validation import check_options
+    from ocrmypdf.cli import get_parser
+
+    import ocr_pipeline
+
+    with api._api_lock:
+        start = time.perf_counter()
+        parser = get_parser()
+        _plugin_manager.hook.add_options(parser=parser)
+        options = api.create_options(
+            input_file=input_path, output_file=output_path, parser=parser, **kwargs
+        )
+        check_options(options, _plugin_manager)
+        stats = {"setup_seconds": time.perf_counter() - start}
+        exit_code = ocr_pipeline.run_pipeline(
+            options, _plugin_manager, _page_cache, stats, streamer, work
+        )
+    return exit_code, stats
+
+
+def _send_progress(job_id, state):
+    if _events is not None:
+        _events.put((job_id, state))
+
+
+def run_ocr(job_id, input_path, output_path, submitted_at, jobs=None, stream_dir=None):
+    """
+    Run ocrmypdf on one file inside a warm worker and return timing stats.
+
+    jobs is the number of pages processed in parallel, as allotted by the
+    CPU budget (see admission); None leaves ocrmypdf's default of every CPU.
+    With stream_dir, finished pages are published there in order while the
+    job runs (see page_stream).
+    """
+    from ocr_plugins import progress
+    from page_stream import PageStreamer
+    from workfolder import WorkFolder
+
+    options = dict(OCR_OPTIONS)
+    if jobs:
+        options["jobs"] = jobs
+    streamer = None
+    if stream_dir:
+        streamer = PageStreamer(stream_dir, config.STREAM_RANGE_PAGES)
+    started_at = time.time()
+    progress.start(functools.partial(_send_progress, job_id))
+    try:
+        exit_code, stats = _ocr(
+            input_path,
+            output_path,
+            streamer,
+            WorkFolder(config.MEMORY_WORK_DIR, config.MEMORY_WORK_BYTES),
+            **options,
+        )
+    finally:
+        phases = progress.stop()
+    setup_seconds = stats.pop("setup_seconds")
+    stats.update(
+        {
+            "exit_code": int(exit_code),
+            # Per-request start-up overhead with warm workers: handing the job
+            # to the pool plus parsing and checking the options
+            "startup_seconds": started_at - submitted_at + setup_seconds,
+            "ocr_seconds": time.time() - started_at - setup_seconds,
+            "worker_warmup_seconds": _warmup_seconds,
+            "phase_seconds": phases,
+        }
+    )
+    return stats
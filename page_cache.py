@@ -0,0 +1,197 @@
+"""
+Cache of per-page OCR results.
+
+A page is identified by a hash of its page dictionary (content streams,
+resources, boxes, rotation) plus the options that shape its OCR, so a
+document that comes back with a page replaced or pages appended only sends
+the new pages to tesseract. The cached files are exactly what OcrGrafter
+needs to graft the page back: the rasterized page PDF, the text layer PDF
+(hOCR rendered or tesseract's text-only PDF) and the page text.
+"""
+import hashlib
+import json
+import logging
+import os
+from importlib.metadata import version
+from pathlib import Path
+
+import pikepdf
+from ocrmypdf._pipelines._common import PageResult
+
+from result_cache import DiskCache, link_or_copy
+
+logger = logging.getLogger(__name__)
+
+# Options that do not change the OCR of a page
+IGNORED_OPTIONS = {
+    "input_file",
+    "output_file",
+    "sidecar",
+    "jobs",
+    "use_threads",
+    "progress_bar",
+    "keep_temporary_files",
+    "verbose",
+    "quiet",
+    "plugins",
+    "title",
+    "author",
+    "subject",
+    "keywords",
+    "optimize",
+    "output_type",
+    "pdfa_image_compression",
+    "fast_web_view",
+}
+
+_FILES = {
+    "pdf_page_from_image": "visible.pdf",
+    "ocr": "ocr.pdf",
+    "text": "ocr.txt",
+}
+
+
+def _feed(digest, root, pages):
+    """
+    Hash the PDF object graph of the page root independently of object
+    numbers. Other pages it refers to (link destinations, the /P of its
+    annotations) are hashed as their index in pages, an {objgen: index}
+    map, without following them: the key of a page does not change with the
+    pages it links to, and the walk stays within the page.
+    """
+    seen = {}
+    # Objects still to hash, and the bytes that go between them
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, bytes):
+            digest.update(obj)
+            continue
+        if isinstance(obj, pikepdf.Object) and obj.is_indirect:
+            if obj.objgen in seen:
+                digest.update(b"R%d;" % seen[obj.objgen])
+                continue
+            if obj.objgen in pages and obj.objgen != root.objgen:
+                digest.update(b"P%d;" % pages[obj.objgen])
+                continue
+            seen[obj.objgen] = len(seen)
+
+        if isinstance(obj, (pikepdf.Stream, pikepdf.Dictionary)):
+            items = [b"stream(<<" if isinstance(obj, pikepdf.Stream) else b"<<"]
+            for key in sorted(obj.keys()):
+                if key != "/Parent":
+                    items += [key.encode(), obj[key]]
+            items.append(b">>")
+            if isinstance(obj, pikepdf.Stream):
+                items += [obj.read_raw_bytes(), b")"]
+        elif isinstance(obj, pikepdf.Array):
+            items = [b"[", *obj, b"]"]
+        elif isinstance(obj, pikepdf.String):
+            items = [b"(" + bytes(obj) + b")"]
+        else:
+            items = [repr(obj).encode() + b";"]
+        stack.extend(reversed(items))
+
+
+def options_fingerprint(options, ocr_engine):
+    """
+    The part of the options (and tools) that decides how a page is OCR'd
+    """
+    fingerprint = {
+        "ocrmypdf": version("ocrmypdf"),
+        "engine": str(ocr_engine),
+    }
+    for name, value in sorted(vars(options).items()):
+        if name in IGNORED_OPTIONS:
+            continue
+        if isinstance(value, (str, int, float, bool, type(None))):
+            fingerprint[name] = value
+        elif isinstance(value, (list, tuple)):
+            fingerprint[name] = [str(v) for v in value]
+        else:
+            fingerprint[name] = str(value)
+    return json.dumps(fingerprint, sort_keys=True).encode()
+
+
+class PageCache(DiskCache):
+    """
+    Disk cache of OCR'd pages, one directory per page
+    """
+
+    def page_keys(self, context):
+        """
+        Cache key of every page of the document being processed. Pages
+        that cannot be hashed get None and are not cached; the document gets
+        None if it cannot be read
+        """
+        fingerprint = options_fingerprint(
+            context.options, context.plugin_manager.hook.get_ocr_engine()
+        )
+        keys = []
+        try:
+            with pikepdf.open(context.origin) as pdf:
+                pages = {page.obj.objgen: n for n, page in enumerate(pdf.pages)}
+                for page in pdf.pages:
+                    digest = hashlib.sha256(fingerprint)
+                    try:
+                        _feed(digest, page.obj, pages)
+                    except Exception as e:
+                        # Not cached, rather than failing the job
+                        logger.warning(f"Page {len(keys) + 1} not cached: {e!r}")
+                        keys.append(None)
+                    else:
+                        keys.append(digest.hexdigest())
+        except Exception as e:
+            logger.warning(f"Page cache not used for this document: {e!r}")
+            return None
+        return keys
+
+    def get(self, key, page_context):
+        """
+        Restore a cached page into the work folder as a PageResult, or None
+        """
+        path = self._lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(os.path.join(path, "page.json")) as f:
+                meta = json.load(f)
+            files = {}
+            for field in meta["files"]:
+                restored = page_context.get_path(f"cached_{_FILES[field]}")
+                link_or_copy(os.path.join(path, _FILES[field]), restored)
+                files[field] = restored
+        except FileNotFoundError:
+            return None  # Evicted while we were reading it
+        return PageResult(
+            pageno=page_context.pageno,
+            orientation_correction=meta["orientation_correction"],
+            **files,
+        )
+
+    def put(self, key, result):
+        """
+        Store the files of a finished page
+        """
+        if not self.enabled or result.ocr is None:
+            return
+        tmp_path = self._tmp_path(key)
+        os.makedirs(tmp_path)
+        size = 0
+        fields = []
+        for field, name in _FILES.items():
+            src = getattr(result, field)
+            if src is None:
+                continue
+            link_or_copy(src, os.path.join(tmp_path, name))
+            size += Path(src).stat().st_size
+            fields.append(field)
+        with open(os.path.join(tmp_path, "page.json"), "w") as f:
+            json.dump(
+                {
+                    "files": fields,
+                    "orientation_correction": result.orientation_correction,
+                },
+                f,
+            )
+        self._publish(key, tmp_path, size)
@@ -0,0 +1,52 @@
+"""
+The order in which a job's pages are handed to the page workers.
+
+ocrmypdf hands them out in document order, so a document whose large pages
+(colour plates, maps, foldouts) come last ends with one worker busy on them
+while the others are idle. largest_first hands out the pages expected to
+take longest first, by an estimate from what ocrmypdf found out about each
+page before OCR: the pixels it is rendered with, the bytes each of them
+takes, and the images in it to decode. Pages of the same cost keep document
+order, so runs of similar pages still rasterize in batches (see
+ocr_plugins.batch_raster).
+
+Streamed jobs (page_stream) publish their pages in document order and keep
+it, so that the first pages are ready as soon as possible.
+"""
+from ocrmypdf._pipeline import calculate_image_dpi, get_canvas_square_dpi
+
+import config
+from ocr_plugins.batch_raster import raster_device
+
+# Bytes per pixel of the page image each ghostscript device renders, which
+# tesseract then reads and binarizes
+_PIXEL_BYTES = {"pngmono": 1, "pnggray": 1, "png256": 1, "png16m": 3}
+# Decoding an image of the page costs about as much as a megapixel of it
+IMAGE_COST = 1024**2
+
+
+def page_cost(page_context):
+    """
+    Estimated work of rasterizing and OCR'ing the page of page_context, in
+    bytes of page image
+    """
+    pageinfo = page_context.pageinfo
+    dpi = get_canvas_square_dpi(page_context, calculate_image_dpi(page_context))
+    pixels = (
+        float(pageinfo.width_inches) * dpi.x * float(pageinfo.height_inches) * dpi.y
+    )
+    return (
+        pixels * _PIXEL_BYTES[raster_device(pageinfo)]
+        + len(pageinfo.images) * IMAGE_COST
+    )
+
+
+def largest_first(page_contexts):
+    """
+    page_contexts in the order they are OCR'd with PDFOCR_PAGE_ORDER: the
+    costliest first, or as given
+    """
+    if config.PAGE_ORDER != "largest":
+        return list(page_contexts)
+    # sorted is stable with reverse too: pages of equal cost keep their order
+    return sorted(page_contexts, key=page_cost, reverse=True)
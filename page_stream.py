@@ -0,0 +1,116 @@
+"""
+In-order publishing of OCR'd pages while a job is still running.
+
+As pages are grafted, every run of range_size consecutive finished pages
+from the start of the document is copied to its own PDF, and a manifest
+lists the ranges ready so far. A client can download the first pages of a
+long scan while tesseract is still working on the rest. The ranges contain
+the OCR'd pages as grafted; PDF/A conversion and optimization only apply to
+the complete result.
+"""
+import bisect
+import json
+import logging
+import os
+
+import pikepdf
+
+from ocr_plugins import progress
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "manifest.json"
+
+
+def range_name(first, last):
+    return f"{first:06d}-{last:06d}.pdf"
+
+
+def read_manifest(directory):
+    """
+    The manifest of a streamed job, or None if nothing was published yet
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+class PageStreamer:
+    """
+    Publishes the pages of one document, in order, to directory
+    """
+
+    def __init__(self, directory, range_size):
+        self.directory = directory
+        self.range_size = max(1, range_size)
+        self.npages = 0
+        self.next_page = 0
+        self.ranges = []
+        self._finished = []
+        # Ranges still being filled: index -> (part PDF, page numbers in it)
+        self._parts = {}
+
+    def start(self, npages):
+        os.makedirs(self.directory, exist_ok=True)
+        self.npages = npages
+        self._finished = [False] * npages
+        self._write_manifest()
+
+    def page_done(self, pageno, page):
+        """
+        page is the final version of page pageno (0-based); publish whatever
+        ranges are now complete
+        """
+        # Copy the page now: the grafter may close the PDF it lives in
+        # before the range is complete
+        part, pagenos = self._parts.setdefault(
+            pageno // self.range_size, (pikepdf.new(), [])
+        )
+        index = bisect.bisect(pagenos, pageno)
+        pagenos.insert(index, pageno)
+        part.pages.insert(index, page)
+
+        self._finished[pageno] = True
+        ready = self.next_page
+        while ready < self.npages and self._finished[ready]:
+            ready += 1
+        while ready - self.next_page >= self.range_size or (
+            ready == self.npages and ready > self.next_page
+        ):
+            self._publish(min(self.next_page + self.range_size, ready))
+
+    def _publish(self, last):
+        first = self.next_page
+        name = range_name(first + 1, last)
+        path = os.path.join(self.directory, name)
+        part, _ = self._parts.pop(first // self.range_size)
+        with part:
+            part.save(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+        self.next_page = last
+        self.ranges.append(
+            {
+                "first": first + 1,
+                "last": last,
+                "file": name,
+                "size": os.path.getsize(path),
+            }
+        )
+        self._write_manifest()
+        progress.update(pages_streamed=last)
+        logger.debug(f"Published pages {first + 1}-{last}")
+
+    def _write_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(
+                {
+                    "pages": self.npages,
+                    "ranges": self.ranges,
+                    "complete": self.next_page == self.npages,
+                },
+                f,
+            )
+        os.replace(f"{path}.tmp", path)
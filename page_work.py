@@ -0,0 +1,112 @@
+"""
+Compact page tasks for the page workers.
+
+ocrmypdf hands each page worker a PageContext, which pickles the job's
+options and plugin manager with every page; unpickling the plugin manager
+sets it up again, plugins and hook specifications included, for each page.
+JobState writes what the pages of a job share (options, plugin manager,
+input and work folder) to the work folder once, and each page task is a
+PageWork with only what is the page's own: its number, which of the job's
+options it uses and its PageInfo. A worker loads the job's state the first
+time it gets one of its pages and builds the PageContext the page stages
+expect from it.
+
+Workers forked from the job's process, and threads, find the state already
+loaded; workers started otherwise read it from the work folder.
+"""
+import os
+import pickle
+from collections import namedtuple
+from copy import copy
+
+from ocrmypdf._jobcontext import PageContext
+
+STATE_FILE = "page_work.pickle"
+
+# A page task: the path of its job's state, the page number, the index of
+# the page's options among the job's, and the page's PageInfo
+PageWork = namedtuple("PageWork", ["job", "pageno", "options", "pageinfo"])
+
+# Job states of this process, by path: the ones it wrote, and the last one
+# it read (a worker only serves one job at a time)
+_written = {}
+_read = (None, None)
+
+
+def _picklable(options):
+    # As PageContext.__getstate__: input and output may be streams
+    options = copy(options)
+    for name in ("input_file", "output_file"):
+        if not isinstance(getattr(options, name), (str, bytes, os.PathLike)):
+            setattr(options, name, "stream")
+    return options
+
+
+class JobState:
+    """
+    The state shared by the page tasks of context's job, for the pages of
+    page_contexts, saved in its work folder while the with block runs
+    """
+
+    def __init__(self, context, page_contexts):
+        self.path = os.fspath(context.work_folder / STATE_FILE)
+        self.page_contexts = page_contexts
+        # Pages may have options of their own (see keep_scanned_pages)
+        self._options = {}
+        for page_context in page_contexts:
+            self._options.setdefault(id(page_context.options), page_context.options)
+        self.state = dict(
+            work_folder=context.work_folder,
+            origin=context.origin,
+            plugin_manager=context.plugin_manager,
+            options=[_picklable(options) for options in self._options.values()],
+        )
+
+    def __enter__(self):
+        with open(self.path, "wb") as f:
+            pickle.dump(self.state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        _written[self.path] = self.state
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _written.pop(self.path, None)
+
+    def page_work(self):
+        """
+        The page tasks, in the order of page_contexts
+        """
+        index = {key: n for n, key in enumerate(self._options)}
+        return [
+            PageWork(
+                self.path,
+                page_context.pageno,
+                index[id(page_context.options)],
+                page_context.pageinfo,
+            )
+            for page_context in self.page_contexts
+        ]
+
+
+def _state(path):
+    global _read
+    if path in _written:
+        return _written[path]
+    if _read[0] != path:
+        with open(path, "rb") as f:
+            _read = (path, pickle.load(f))
+    return _read[1]
+
+
+def page_context(work):
+    """
+    The PageContext of the PageWork work
+    """
+    state = _state(work.job)
+    page_context = PageContext.__new__(PageContext)
+    page_context.work_folder = state["work_folder"]
+    page_context.origin = state["origin"]
+    page_context.options = state["options"][work.options]
+    page_context.pageno = work.pageno
+    page_context.pageinfo = work.pageinfo
+    page_context.plugin_manager = state["plugin_manager"]
+    return page_context
@@ -0,0 +1,192 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def link_or_copy(src, dst):
+    """
+    Hard link src to dst when they share a filesystem, copy otherwise
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _entry_size(entry):
+    if entry.is_dir(follow_symlinks=False):
+        return sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+    return entry.stat().st_size
+
+
+class DiskCache:
+    """
+    Size-bounded LRU cache of files on disk.
+
+    The directory is the source of truth, so several processes can share a
+    cache: entries are published with an atomic rename, a hit refreshes the
+    entry's modification time, and when the approximate size goes over
+    max_bytes the directory is rescanned and the least recently used entries
+    are removed.
+    """
+
+    suffix = ""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = 0
+        self._size = 0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._scan()
+            logger.info(
+                f"{type(self).__name__}: {self._entries} entries, {self._size} bytes"
+            )
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _scan(self):
+        """
+        Measure the cache; returns its entries, oldest first
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(self.suffix) or ".tmp" in entry.name:
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, _entry_size(entry), entry))
+            except FileNotFoundError:
+                continue  # Evicted by another process meanwhile
+        entries.sort(key=lambda item: item[0])
+        self._entries = len(entries)
+        self._size = sum(size for _mtime, size, _entry in entries)
+        return entries
+
+    def _lookup(self, key):
+        """
+        Path of the entry for key, marked as recently used, or None
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def _publish(self, key, tmp_path, size):
+        """
+        Move a fully written entry into place and keep the cache in budget
+        """
+        path = self._path(key)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Already published by someone else (directories cannot be
+            # replaced); keep theirs
+            _remove(tmp_path)
+            return
+        with self._lock:
+            self._entries += 1
+            self._size += size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        for _mtime, size, entry in self._scan():
+            if self._size <= self.max_bytes:
+                break
+            _remove(entry.path)
+            self._entries -= 1
+            self._size -= size
+            logger.debug(f"{type(self).__name__}: evicted {entry.name}")
+
+    def _tmp_path(self, key):
+        return f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": self._entries,
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+
+class ResultCache(DiskCache):
+    """
+    Disk cache of OCR results, addressed by the input bytes and the options
+    """
+
+    suffix = "_ocr.pdf"
+
+    def key(self, input_path, options):
+        """
+        Cache key for an input file processed with the given options
+        """
+        digest = hashlib.sha256()
+        with open(input_path, "rb") as f:
+            while chunk := f.read(CHUNK_SIZE):
+                digest.update(chunk)
+        digest.update(json.dumps(options, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get(self, key, output_path):
+        """
+        Put the cached result for key at output_path; returns False on a miss
+        """
+        path = self._lookup(key)
+        if path is None:
+            return False
+        try:
+            link_or_copy(path, output_path)
+        except FileNotFoundError:
+            return False  # Evicted between lookup and link
+        return True
+
+    def put(self, key, output_path):
+        """
+        Store a finished result and evict old entries if over budget
+        """
+        if not self.enabled:
+            return
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        tmp_path = self._tmp_path(key)
+        link_or_copy(output_path, tmp_path)
+        self._publish(key, tmp_path, size)
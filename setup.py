@@ -9,6 +9,15 @@ setup(
         'flask-cors',
         'ocrmypdf'
     ],
+    extras_require={
+        'production': [
+            "gunicorn; platform_system != 'Windows'",
+            "waitress; platform_system == 'Windows'"
+        ],
+        'resident': [
+            'tesserocr'
+        ]
+    },
     entry_points={
         'console_scripts': [
             'pdfocr=start:main'
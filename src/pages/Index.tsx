@@ -6,9 +6,42 @@ import { Upload, FileText } from "lucide-react";
 import { useState } from "react";
 import { saveAs } from 'file-saver';
 
+const API_URL = 'http://localhost:5000';
+const POLL_INTERVAL_MS = 2000;
+// A partir de este tamaño el PDF se sube por bloques reanudables
+const CHUNKED_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const CHUNK_RETRIES = 5;
+
+const PHASE_LABELS: Record<string, string> = {
+  triage: 'Analizando el documento',
+  ocr: 'Reconociendo texto',
+  graft: 'Uniendo páginas',
+  pdfa: 'Convirtiendo a PDF/A',
+  optimize: 'Optimizando',
+  output: 'Guardando'
+};
+
+interface JobProgress {
+  phase?: string | null;
+  pages?: number | null;
+  pages_ocr?: number;
+  pages_from_cache?: number;
+}
+
+const describeProgress = (progress: JobProgress) => {
+  if (!progress.phase) return 'En cola...';
+  const label = PHASE_LABELS[progress.phase] ?? progress.phase;
+  if (progress.phase === 'ocr' && progress.pages) {
+    const done = (progress.pages_ocr ?? 0) + (progress.pages_from_cache ?? 0);
+    return `${label}: ${done}/${progress.pages} páginas`;
+  }
+  return `${label}...`;
+};
+
 const Index = () => {
   const [selectedFile, setSelectedFile] = useState<File | null>(null);
   const [isProcessing, setIsProcessing] = useState(false);
+  const [progressText, setProgressText] = useState<string | null>(null);
   const { toast } = useToast();
 
   const handleFileChange = (event: React.ChangeEvent<HTMLInputElement>) => {
@@ -30,18 +63,118 @@ const Index = () => {
     }
   };
 
+  const waitForJob = async (statusUrl: string) => {
+    while (true) {
+      await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+      const response = await fetch(`${API_URL}${statusUrl}`);
+      const job = await response.json();
+
+      if (job.status === "done") {
+        return job;
+      }
+      if (job.status === "failed" || !response.ok) {
+        console.error('Job Error Response:', job);
+        throw new Error(`Error processing PDF: ${job.error || response.statusText}`);
+      }
+    }
+  };
+
+  // Sigue el trabajo por server-sent events; si la conexión falla, vuelve al sondeo
+  const followJob = (eventsUrl: string, statusUrl: string) =>
+    new Promise((resolve, reject) => {
+      const source = new EventSource(`${API_URL}${eventsUrl}`);
+      source.addEventListener('progress', (event) => {
+        setProgressText(describeProgress(JSON.parse((event as MessageEvent).data).progress));
+      });
+      source.addEventListener('done', (event) => {
+        source.close();
+        resolve(JSON.parse((event as MessageEvent).data));
+      });
+      source.addEventListener('failed', (event) => {
+        source.close();
+        const job = JSON.parse((event as MessageEvent).data);
+        console.error('Job Error Response:', job);
+        reject(new Error(`Error processing PDF: ${job.error}`));
+      });
+      source.onerror = () => {
+        source.close();
+        waitForJob(statusUrl).then(resolve, reject);
+      };
+    });
+
+  const sha256Hex = async (data: ArrayBuffer) => {
+    const digest = await crypto.subtle.digest('SHA-256', data);
+    return Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, '0'))
+      .join('');
+  };
+
+  const uploadChunk = async (uploadUrl: string, file: File, chunkSize: number, index: number) => {
+    const data = await file.slice(index * chunkSize, (index + 1) * chunkSize).arrayBuffer();
+    const checksum = await sha256Hex(data);
+
+    for (let attempt = 1; ; attempt++) {
+      try {
+        const response = await fetch(`${API_URL}${uploadUrl}/chunks/${index}`, {
+          method: 'PUT',
+          headers: { 'X-Chunk-SHA256': checksum },
+          body: data
+        });
+        if (response.ok) return;
+        if (response.status !== 422 || attempt >= CHUNK_RETRIES) {
+          throw new Error(`Error uploading chunk ${index}: ${response.statusText}`);
+        }
+      } catch (error) {
+        if (attempt >= CHUNK_RETRIES) throw error;
+      }
+      // Un corte de red solo cuesta el bloque en curso: esperar y reenviarlo
+      await new Promise((resolve) => setTimeout(resolve, 1000 * 2 ** attempt));
+    }
+  };
+
+  const uploadInChunks = async (file: File) => {
+    const init = await fetch(`${API_URL}/uploads`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!init.ok) return init;
+    const { upload_url, chunk_size } = await init.json();
+
+    // Reenviar solo los bloques que el servidor aún no tiene
+    while (true) {
+      const status = await (await fetch(`${API_URL}${upload_url}`)).json();
+      if (status.missing.length === 0) break;
+      for (const index of status.missing) {
+        await uploadChunk(upload_url, file, chunk_size, index);
+      }
+    }
+
+    return fetch(`${API_URL}${upload_url}/finalize`, { method: 'POST' });
+  };
+
+  const submitDocument = (file: File) => {
+    if (file.size >= CHUNKED_UPLOAD_THRESHOLD) {
+      return uploadInChunks(file);
+    }
+    // El PDF se envía tal cual para que el servidor lo escriba a disco por bloques
+    return fetch(`${API_URL}/jobs`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/pdf',
+        'X-Filename': encodeURIComponent(file.name)
+      },
+      body: file
+    });
+  };
+
   const processDocument = async () => {
     if (!selectedFile) return;
 
     setIsProcessing(true);
-    const formData = new FormData();
-    formData.append('file', selectedFile);
 
     try {
-      const response = await fetch('http://localhost:5000/process-pdf', {
-        method: 'POST',
-        body: formData
-      });
+      const response = await submitDocument(selectedFile);
 
       if (!response.ok) {
         const errorText = await response.text();
@@ -53,7 +186,15 @@ const Index = () => {
         throw new Error(`Error processing PDF: ${errorText || response.statusText}`);
       }
 
-      const blob = await response.blob();
+      const { status_url, events_url, result_url } = await response.json();
+      await followJob(events_url, status_url);
+
+      const result = await fetch(`${API_URL}${result_url}`);
+      if (!result.ok) {
+        throw new Error(`Error downloading PDF: ${result.statusText}`);
+      }
+
+      const blob = await result.blob();
       saveAs(blob, `OCR-${selectedFile.name}`);
       
       toast({
@@ -69,6 +210,7 @@ const Index = () => {
       });
     } finally {
       setIsProcessing(false);
+      setProgressText(null);
     }
   };
 
@@ -105,7 +247,7 @@ const Index = () => {
               className="w-full"
             >
               <FileText className="mr-2 h-4 w-4" />
-              {isProcessing ? "Procesando..." : "Procesar documento"}
+              {isProcessing ? progressText ?? "Procesando..." : "Procesar documento"}
             </Button>
           </CardContent>
         </Card>
@@ -1,5 +1,6 @@
 import os
 import sys
+import argparse
 import subprocess
 import platform
 import shutil
@@ -120,7 +121,14 @@ def get_virtual_env_activation_command(os_name):
         print(f"⚠️ Sistema operativo no soportado: {os_name}")
         sys.exit(1)
 
-def install_python_dependencies(os_name):
+def get_production_server(os_name):
+    """
+    Get the package that serves the backend in production mode
+    """
+    # gunicorn no funciona en Windows; waitress sirve con hilos en un solo proceso
+    return 'waitress' if os_name == 'windows' else 'gunicorn'
+
+def install_python_dependencies(os_name, production=False):
     """
     Install Python dependencies in virtual environment
     """
@@ -130,12 +138,16 @@ def install_python_dependencies(os_name):
         # Get activation command
         activate_cmd = get_virtual_env_activation_command(os_name)
         
+        packages = "flask flask-cors ocrmypdf"
+        if production:
+            packages += f" {get_production_server(os_name)}"
+        
         # Prepare the full command to activate venv and install dependencies
         full_command = ""
         if os_name in ['linux', 'darwin']:
-            full_command = f"{activate_cmd} && pip install flask flask-cors ocrmypdf"
+            full_command = f"{activate_cmd} && pip install {packages}"
         elif os_name == 'windows':
-            full_command = f"{activate_cmd} && pip install flask flask-cors ocrmypdf"
+            full_command = f"{activate_cmd} && pip install {packages}"
         
         # Validate full_command before using
         if not full_command:
@@ -170,7 +182,24 @@ def install_node_dependencies():
         print(f"❌ Error instalando dependencias de Node.js: {e}")
         sys.exit(1)
 
-def start_backend_frontend(os_name):
+def get_backend_command(os_name, production=False):
+    """
+    Get the command that runs the backend
+    """
+    if not production:
+        # Servidor de desarrollo de Flask: un proceso, con recarga automática
+        return "python app.py"
+    
+    print("🏭 Modo producción: servidor multiproceso")
+    if get_production_server(os_name) == 'gunicorn':
+        # Procesos, hilos, timeouts y keep-alive se leen de gunicorn.conf.py
+        return "gunicorn -c gunicorn.conf.py app:app"
+    
+    bind = os.environ.get('PDFOCR_BIND', '0.0.0.0:5000')
+    threads = os.environ.get('PDFOCR_WEB_THREADS', '16')
+    return f"waitress-serve --listen={bind} --threads={threads} app:app"
+
+def start_backend_frontend(os_name, production=False):
     """
     Start backend and frontend processes
     """
@@ -179,10 +208,11 @@ def start_backend_frontend(os_name):
     try:
         # Get activation command
         activate_cmd = get_virtual_env_activation_command(os_name)
+        backend_cmd = get_backend_command(os_name, production)
         
         # Subprocess to run backend
         backend_process = subprocess.Popen(
-            f"{activate_cmd} && python app.py",
+            f"{activate_cmd} && {backend_cmd}",
             shell=True,
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE
@@ -208,10 +238,25 @@ def start_backend_frontend(os_name):
         print(f"❌ Error iniciando procesos: {e}")
         sys.exit(1)
 
+def parse_args():
+    """
+    Parse the command line options
+    """
+    parser = argparse.ArgumentParser(description='PDF OCR Processing Application')
+    parser.add_argument(
+        '--production',
+        action='store_true',
+        default=os.environ.get('PDFOCR_PRODUCTION') == '1',
+        help='Servir el backend con gunicorn (waitress en Windows) en lugar del servidor de desarrollo'
+    )
+    return parser.parse_args()
+
 def main():
     """
     Main script to set up and start the application
     """
+    args = parse_args()
+    
     try:
         # Detect operating system
         os_name = detect_os()
@@ -220,13 +265,13 @@ def main():
         create_virtual_environment(os_name)
         
         # Install Python dependencies
-        install_python_dependencies(os_name)
+        install_python_dependencies(os_name, args.production)
         
         # Install Node.js dependencies
         install_node_dependencies()
         
         # Start backend and frontend
-        start_backend_frontend(os_name)
+        start_backend_frontend(os_name, args.production)
     
     except Exception as e:
         print(f"❌ Error inesperado: {e}")
@@ -0,0 +1,304 @@
+"""
+Upload handling: the request body goes straight to the job's work directory
+in fixed-size chunks instead of being buffered by the form parser first.
+Large files can also be sent as a resumable upload, one checksummed chunk
+per request.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+import uuid
+
+import pikepdf
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+logger = logging.getLogger(__name__)
+
+PDF_MAGIC = b"%PDF-"
+# PDF readers accept the header anywhere in the first kilobyte
+HEADER_WINDOW = 1024
+
+# Description of a resumable upload, in its directory
+UPLOAD_FILE = "upload.json"
+UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+
+class InvalidPdfError(Exception):
+    """
+    Raised when an upload is not a readable PDF
+    """
+
+
+class IncompleteUploadError(Exception):
+    """
+    Raised when a chunked upload is finalized with chunks still missing
+    """
+
+    def __init__(self, missing):
+        super().__init__(f"{len(missing)} chunks missing")
+        self.missing = missing
+
+
+class ChecksumMismatchError(Exception):
+    """
+    Raised when a chunk does not match the checksum sent with it
+    """
+
+
+class SpoolingRequest(Request):
+    """
+    Request whose multipart file parts are written directly into spool_dir.
+
+    Werkzeug's default is a SpooledTemporaryFile in the system temporary
+    directory, which then has to be copied again into the job directory.
+    """
+
+    spool_dir = None
+
+    def _get_file_stream(
+        self, total_content_length, content_type, filename=None, content_length=None
+    ):
+        if self.spool_dir is None:
+            return super()._get_file_stream(
+                total_content_length, content_type, filename, content_length
+            )
+        return tempfile.NamedTemporaryFile(
+            "wb+", dir=self.spool_dir, suffix=".upload", delete=False
+        )
+
+
+def spool_stream(stream, dest_path, max_bytes, chunk_size):
+    """
+    Copy a request body to dest_path chunk by chunk.
+
+    The size limit is enforced while reading, so chunked uploads without a
+    Content-Length are stopped as soon as they go over it, and bodies that
+    do not start like a PDF are refused after the first chunk.
+    """
+    written = 0
+    with open(dest_path, "wb") as dest:
+        while chunk := stream.read(chunk_size):
+            if written == 0 and PDF_MAGIC not in chunk[:HEADER_WINDOW]:
+                raise InvalidPdfError("Missing %PDF- header")
+            written += len(chunk)
+            if max_bytes and written > max_bytes:
+                raise RequestEntityTooLarge()
+            dest.write(chunk)
+    if written == 0:
+        raise InvalidPdfError("Empty upload")
+    return written
+
+
+def adopt_spooled_file(file_storage, dest_path):
+    """
+    Move a multipart file part spooled by SpoolingRequest into place
+    """
+    stream = file_storage.stream
+    name = getattr(stream, "name", None)
+    if isinstance(name, str) and os.path.exists(name):
+        stream.close()
+        os.replace(name, dest_path)
+    else:
+        file_storage.save(dest_path)
+    with open(dest_path, "rb") as f:
+        if PDF_MAGIC not in f.read(HEADER_WINDOW):
+            raise InvalidPdfError("Missing %PDF- header")
+
+
+def triage(path):
+    """
+    Check that a complete upload opens as a PDF and return its page count.
+
+    This only reads the trailer and cross-reference table, which are at the
+    end of the file for all but linearized PDFs, so it runs as soon as the
+    last chunk is written and long before a worker would find out.
+    """
+    try:
+        with pikepdf.open(path) as pdf:
+            return len(pdf.pages)
+    except pikepdf.PasswordError as e:
+        raise InvalidPdfError("Encrypted PDF") from e
+    except pikepdf.PdfError as e:
+        raise InvalidPdfError(str(e)) from e
+
+
+class ChunkedUpload:
+    """
+    An upload sent in fixed-size chunks that can arrive in any order and be
+    retried, so a dropped connection only costs the chunk in flight.
+
+    Chunks are written at their offset in a file preallocated to the final
+    size once their checksum has matched, and then recorded as received with
+    a marker file. All the state is on disk, so any
+    server process can take the next chunk.
+    """
+
+    def __init__(self, upload_id, filename, size, chunk_size, directory):
+        self.id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.directory = directory
+        self.data_path = os.path.join(directory, "upload.pdf")
+        self.chunks_dir = os.path.join(directory, "chunks")
+
+    @property
+    def chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    @property
+    def received(self):
+        try:
+            return {int(name) for name in os.listdir(self.chunks_dir)}
+        except FileNotFoundError:
+            return set()
+
+    def chunk_length(self, index):
+        if index == self.chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def missing(self):
+        received = self.received
+        return [n for n in range(self.chunks) if n not in received]
+
+    def to_dict(self):
+        missing = self.missing()
+        return {
+            "upload_id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunks": self.chunks,
+            "received": self.chunks - len(missing),
+            "missing": missing,
+        }
+
+
+class UploadStore:
+    """
+    Resumable uploads in progress, each in its own directory.
+
+    Uploads that receive nothing for ttl seconds are removed.
+    """
+
+    def __init__(self, directory, chunk_size, max_bytes, ttl):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+    def create(self, filename, size):
+        """
+        Start an upload of size bytes and preallocate its file
+        """
+        if size <= 0:
+            raise InvalidPdfError("Empty upload")
+        if self.max_bytes and size > self.max_bytes:
+            raise RequestEntityTooLarge()
+        self._expire()
+        upload_id = uuid.uuid4().hex
+        directory = os.path.join(self.directory, upload_id)
+        upload = ChunkedUpload(upload_id, filename, size, self.chunk_size, directory)
+        os.makedirs(upload.chunks_dir)
+        with open(upload.data_path, "wb") as f:
+            f.truncate(size)
+        with open(os.path.join(directory, UPLOAD_FILE), "w") as f:
+            json.dump(
+                {"filename": filename, "size": size, "chunk_size": self.chunk_size}, f
+            )
+        logger.info(
+            f"Upload {upload_id} started: {size} bytes in {upload.chunks} chunks"
+        )
+        return upload
+
+    def get(self, upload_id):
+        if not UPLOAD_ID.fullmatch(upload_id):
+            return None
+        directory = os.path.join(self.directory, upload_id)
+        try:
+            with open(os.path.join(directory, UPLOAD_FILE)) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        return ChunkedUpload(upload_id, directory=directory, **meta)
+
+    def write_chunk(self, upload, index, stream, checksum, buffer_size):
+        """
+        Write chunk index from stream at its offset and verify its SHA-256.
+
+        The chunk is received into a temporary file and only copied into the
+        upload once it has been verified. Raises IndexError for a chunk
+        number outside the upload, ValueError when the body has the wrong
+        length and ChecksumMismatchError when it does not match checksum; in
+        all cases the upload is left as it was, and a missing chunk can
+        simply be sent again.
+        """
+        if not 0 <= index < upload.chunks:
+            raise IndexError(f"Chunk {index} out of range")
+        expected = upload.chunk_length(index)
+        digest = hashlib.sha256()
+        written = 0
+        with tempfile.TemporaryFile(dir=upload.directory) as received:
+            while data := stream.read(min(buffer_size, expected + 1 - written)):
+                written += len(data)
+                if written > expected:
+                    break
+                digest.update(data)
+                received.write(data)
+            if written != expected:
+                raise ValueError(
+                    f"Chunk {index} has {written} bytes, expected {expected}"
+                )
+            if digest.hexdigest() != checksum.lower():
+                raise ChecksumMismatchError(f"Chunk {index} checksum mismatch")
+            # A chunk sent again is not received while it is being replaced
+            marker = os.path.join(upload.chunks_dir, str(index))
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass
+            received.seek(0)
+            with open(upload.data_path, "r+b") as f:
+                f.seek(index * upload.chunk_size)
+                shutil.copyfileobj(received, f, buffer_size)
+        open(marker, "w").close()
+        # The directory's modification time tells when the upload was last used
+        os.utime(upload.directory)
+
+    def complete(self, upload, dest_path):
+        """
+        Move a fully received upload to dest_path and forget it.
+
+        Raises FileNotFoundError if another request completed it first.
+        """
+        missing = upload.missing()
+        if missing:
+            raise IncompleteUploadError(missing)
+        os.replace(upload.data_path, dest_path)
+        self.discard(upload)
+        with open(dest_path, "rb") as f:
+            if PDF_MAGIC not in f.read(HEADER_WINDOW):
+                raise InvalidPdfError("Missing %PDF- header")
+
+    def discard(self, upload):
+        shutil.rmtree(upload.directory, ignore_errors=True)
+
+    def _expire(self):
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                idle = now - entry.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if UPLOAD_ID.fullmatch(entry.name) and idle > self.ttl:
+                logger.debug(f"Upload {entry.name} expired")
+                shutil.rmtree(entry.path, ignore_errors=True)
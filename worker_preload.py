@@ -0,0 +1,44 @@
+"""
+Imported by the forkserver of the page worker processes (see
+ocr_plugins.executor) before it forks any of them.
+
+Every worker then starts with ocrmypdf, pikepdf, PIL, pdfminer and the
+service's page stages already imported, instead of importing them itself.
+gc.freeze() moves what the imports created out of the garbage collector's
+reach, so that collections in the workers do not write to those objects and
+the memory stays shared with the forkserver (copy-on-write) rather than
+being copied into each worker.
+"""
+import gc
+import importlib
+import logging
+
+from ocr_plugins import PLUGINS
+
+logger = logging.getLogger(__name__)
+
+PRELOAD = [
+    "PIL.Image",
+    "pikepdf",
+    "pdfminer.layout",
+    "pdfminer.pdfinterp",
+    "ocrmypdf",
+    "ocrmypdf._pipeline",
+    "ocrmypdf._pipelines.ocr",
+    "ocrmypdf.builtin_plugins.tesseract_ocr",
+    "ocrmypdf.pdfinfo",
+    "ocr_pipeline",
+    "page_work",
+    *PLUGINS,
+]
+
+for name in PRELOAD:
+    try:
+        importlib.import_module(name)
+    except ImportError as e:
+        # The worker imports it again when it needs it, and reports it then
+        logger.debug(f"Could not preload {name}: {e}")
+
+# Whatever garbage the imports left is collected first, not kept for good
+gc.collect()
+gc.freeze()
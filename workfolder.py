@@ -0,0 +1,128 @@
+"""
+Where a job's intermediate files live.
+
+ocrmypdf puts every intermediate file of a job in one work folder, by
+default in the system's temporary directory. WorkFolder can create it in a
+memory-backed directory (a tmpfs such as /dev/shm) instead, with a byte
+budget per job: whenever the folder grows past the budget, the largest
+whole-document files (the copy of the input, grafted chunks, post-processed
+versions) are moved to a spill folder on disk and replaced by symlinks, so
+the pipeline keeps finding them where it left them. Per-page files are never
+moved, since pages in flight may still be writing them; there are few of
+them at a time (see ocr_plugins.executor). Neither are files still being
+written (*.tmp) nor anything in a subfolder, such as the batch rasterizer's
+renders, which ghostscript and the page workers add to as they go, nor the
+files the job keeps open (see keep): a file stays in memory for as long as
+a process has it open, so moving it would free nothing.
+"""
+import logging
+import os
+import re
+import shutil
+from pathlib import Path
+from tempfile import mkdtemp
+
+logger = logging.getLogger(__name__)
+
+# Files of one page are named after it, see ocrmypdf's PageContext.get_path
+_PAGE_FILE = re.compile(r"^\d{6}_")
+
+
+def _regular_files(path):
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from _regular_files(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry.path, entry.stat(follow_symlinks=False).st_size
+
+
+class WorkFolder:
+    """
+    A job's work folder, in memory_dir while within memory_bytes if both are
+    set and on the default temporary directory otherwise
+    """
+
+    def __init__(self, memory_dir=None, memory_bytes=0):
+        # A small tmpfs (Docker gives containers 64 MB of /dev/shm) or one
+        # filled by other jobs is no place for this one
+        self.in_memory = bool(
+            memory_dir
+            and memory_bytes
+            and os.path.isdir(memory_dir)
+            and shutil.disk_usage(memory_dir).free >= memory_bytes
+        )
+        self.memory_dir = memory_dir if self.in_memory else None
+        self.memory_bytes = memory_bytes
+        self.path = None
+        self.spill_path = None
+        self.peak_bytes = 0
+        self.spilled_bytes = 0
+        self._kept = set()
+
+    def create(self):
+        self.path = Path(mkdtemp(prefix="ocrmypdf.io.", dir=self.memory_dir))
+        return self.path
+
+    def keep(self, path):
+        """
+        Never spill path, a file the job holds open until it is done, such
+        as the input PDF its pages are rendered and grafted from
+        """
+        self._kept.add(os.fspath(path))
+
+    def sample(self, spill=True):
+        """
+        Record the folder's size and, with spill, move files to disk if it is
+        over budget. Call it when no whole-document file is being written.
+        """
+        files = list(_regular_files(self.path))
+        size = sum(file_size for _, file_size in files)
+        on_disk = 0
+        if self.spill_path is not None:
+            on_disk = sum(file_size for _, file_size in _regular_files(self.spill_path))
+        self.peak_bytes = max(self.peak_bytes, size + on_disk)
+        if not (spill and self.in_memory) or size <= self.memory_bytes:
+            return
+
+        candidates = [
+            (file_size, path)
+            for path, file_size in files
+            if os.path.dirname(path) == str(self.path)
+            and not path.endswith(".tmp")
+            and path not in self._kept
+            and not _PAGE_FILE.match(os.path.basename(path))
+        ]
+        for file_size, path in sorted(candidates, reverse=True):
+            if size <= self.memory_bytes:
+                break
+            self._spill(path)
+            size -= file_size
+            self.spilled_bytes += file_size
+
+    def _spill(self, path):
+        if self.spill_path is None:
+            self.spill_path = Path(mkdtemp(prefix="ocrmypdf.spill."))
+        target = self.spill_path / os.path.relpath(path, self.path)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(path, target)
+        # Processes that still have the file open keep reading the copy in
+        # memory until they close it; new readers follow the symlink
+        os.symlink(target, f"{path}.spill")
+        os.replace(f"{path}.spill", path)
+        logger.debug(f"Spilled {os.path.basename(path)} to disk")
+
+    def cleanup(self, retain=False):
+        """
+        Remove the spill folder; the work folder itself is ocrmypdf's to
+        remove
+        """
+        if self.spill_path is not None and not retain:
+            shutil.rmtree(self.spill_path, ignore_errors=True)
+
+    def stats(self):
+        return {
+            "work_folder_in_memory": self.in_memory,
+            "work_folder_peak_bytes": self.peak_bytes,
+            "work_folder_spilled_bytes": self.spilled_bytes,
+        }